@@ -1,8 +1,29 @@
-import tellurium as te
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import random
 
+import numpy as np
+
+import instrument
+import model_cache
+from checkpoint import Checkpointer, resume, run_info
+from density import plot_density, rasterize
+from ensemble import EnsembleResult, integrate_batch, run_ensemble
+from integrators import check_backend
+from poincare import poincare_section
+from streaming import iter_numpy, iter_tellurium, save_npy
+
+
+AIZAWA_MODEL = '''
+model aizawa
+    x' = (z - b)*x - d*y
+    y' = d*x + (z - b)*y
+    z' = c + a*z - z*z*z/3 - x*x + f*z*x*x*x
+
+    a = 0.92; b = 0.7; c = 0.67; d = 3.5; e = 0.25; f = 0.1;
+    x = 0.1; y = 0; z = 0;
+end
+'''
+SELECTIONS = ['time', 'x', 'y', 'z']
+
 
 class AizawaAttractor:
     """Brusselator - kaotični sistem"""
@@ -17,55 +38,170 @@ class AizawaAttractor:
         self.gridx = gridx
         self.gridy = gridy
     
-    def solve(self, initial_state=[0.1, 0.0, 0.0], t_end=50, n_points=2000):
-        """Reši sistem z Tellurium"""
+    def rhs(self, t, state):
+        """Desna stran sistema za NumPy integratorje, state ima obliko (..., 3)"""
+        x, y, z = state[..., 0], state[..., 1], state[..., 2]
+        return np.stack([
+            (z - self.b) * x - self.d * y,
+            self.d * x + (z - self.b) * y,
+            self.c + self.a * z - z * z * z / 3 - x * x + self.f * z * x * x * x,
+        ], axis=-1)
+
+    def jvp(self, state, v):
+        """Produkt Jacobijeve matrike v točki state z vektorji v (oblike (..., 3))"""
+        x, y, z = state[..., 0], state[..., 1], state[..., 2]
+        vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+        return np.stack([
+            (z - self.b) * vx - self.d * vy + x * vz,
+            self.d * vx + (z - self.b) * vy + y * vz,
+            (3 * self.f * z * x * x - 2 * x) * vx + (self.a - z * z + self.f * x * x * x) * vz,
+        ], axis=-1)
+
+    def params(self):
+        """Parametri modela kot slovar"""
+        return {'a': self.a, 'b': self.b, 'c': self.c, 'd': self.d, 'e': self.e, 'f': self.f}
+
+    def grid_states(self, initial_state):
+        """Začetni pogoji za gridx * gridy simulacij"""
+        x0, y0, z0 = initial_state
+        # x0 += (r//self.gridy) * 0.2
+        # y0 += (r%self.gridy) * 0.2
+        return [(x0, y0, z0) for r in range(self.gridx * self.gridy)]
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[0.1, 0.0, 0.0], t_end=50, n_points=2000, workers=None,
+              backend='tellurium', method='dopri5', dtype=None, out=None, chunk_points=10000,
+              checkpoint=None, checkpoint_every=60.0, resume_from=None, extend_to=None):
+        """Reši sistem z Tellurium za vse začetne pogoje
+
+        workers > 1 porazdeli simulacije med procese, backend='numpy' pa
+        vse začetne pogoje reši hkrati kot en paket. Vrne EnsembleResult s
+        skupnim časom in stanji oblike (n_runs, n_points, dim); dtype
+        (npr. np.float32) določi tip shranjenih stanj.
+
+        Če je podana pot out, se ena trajektorija iz initial_state po kosih
+        zapisuje v .npy datoteko (memmap), vrne pa se (t, solution) kot
+        pogleda vanjo. Z checkpoint se napredek shrani vsakih
+        checkpoint_every sekund in na koncu; resume_from nadaljuje tako
+        shranjen izračun in dopisuje v njegovo datoteko (nastavitve so iz
+        kontrolne točke, extend_to pa izračun podaljša do novega časa).
+        """
+        check_backend(backend)
+        if resume_from is not None:
+            info, start, state = resume(resume_from, 'AizawaAttractor', self.params(),
+                                        extend_to)
+            chunks = self.solve_iter(state, info['t_end'], info['n_points'],
+                                     info['chunk_points'], info['backend'], info['method'],
+                                     start=start)
+            saver = Checkpointer(checkpoint or resume_from, info, checkpoint_every)
+            result = save_npy(info['out'], chunks, info['n_points'], start, saver)
+            return result[..., 0], result[..., 1:]
+        if checkpoint is not None and out is None:
+            raise ValueError("checkpoint potrebuje datoteko out")
+        if out is not None:
+            chunks = self.solve_iter(initial_state, t_end, n_points, chunk_points, backend, method)
+            saver = None
+            if checkpoint is not None:
+                info = run_info('AizawaAttractor', self.params(), initial_state, t_end,
+                                n_points, chunk_points, backend, method, out)
+                saver = Checkpointer(checkpoint, info, checkpoint_every)
+            result = save_npy(out, chunks, n_points, checkpoint=saver)
+            return result[..., 0], result[..., 1:]
+
+        if backend == 'numpy':
+            y0 = np.array(self.grid_states(initial_state), dtype=float)
+            t, states = integrate_batch(self.rhs, y0, t_end, n_points, method, dtype)
+            return EnsembleResult(t, states, y0, self.params())
+
+        grid = self.grid_states(initial_state)
+        t, states = run_ensemble(self._solve_one, grid, workers=workers, dtype=dtype,
+                                 t_end=t_end, n_points=n_points)
+        return EnsembleResult(t, states, grid, self.params())
+
+    def _load_model(self, initial_state):
         x0, y0, z0 = initial_state
-        
-        
         # model.integrator = 'gillespie'
         # model.integrator.seed = 1234
-        solutions = []
-        ts = []
-        for r in tqdm(range(self.gridx * self.gridy)):
-            x0, y0, z0 = initial_state
-            # x0 += (r//self.gridy) * 0.2
-            # y0 += (r%self.gridy) * 0.2
-            model = te.loada(f'''
-            model aizawa
-                x' = (z - b)*x - d*y
-                y' = d*x + (z - b)*y
-                z' = c + a*z - z*z*z/3 - x*x + f*z*x*x*x
-                
-                a = {self.a}; b = {self.b}; c = {self.c}; d = {self.d}; e = {self.e}; f = {self.f};
-                x = {x0}; y = {y0}; z = {z0};
-            end
-        ''')
-            result = model.simulate(0, t_end, n_points)
-            t = result[:, 0]
-            solution = result[:, 1:]
-            solutions.append(solution)
-            ts.append(t)
-        return ts, solutions
+        return model_cache.load(AIZAWA_MODEL, {
+            'a': self.a, 'b': self.b, 'c': self.c, 'd': self.d,
+            'e': self.e, 'f': self.f, 'x': x0, 'y': y0, 'z': z0,
+        })
+
+    def _solve_one(self, initial_state, t_end, n_points):
+        """Reši sistem za en začetni pogoj"""
+        model = self._load_model(initial_state)
+        with instrument.stage('integrate'):
+            result = model.simulate(0, t_end, n_points, SELECTIONS)
+        instrument.record_array('integrate', result)
+        t = result[:, 0]
+        solution = result[:, 1:]
+        return t, solution
+
+    def solve_iter(self, initial_state=[0.1, 0.0, 0.0], t_end=50, n_points=2000,
+                   chunk_points=10000, backend='tellurium', method='dopri5', start=0):
+        """Ena trajektorija po kosih (t, solution) z največ chunk_points vrsticami
+
+        Pomnilnik je omejen z velikostjo kosa, ne s t_end; kose lahko v
+        .npy datoteko zapiše streaming.save_npy. Pri start > 0 se tok začne
+        pri vzorcu start, initial_state pa je stanje v vzorcu pred njim.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            return iter_numpy(self.rhs, initial_state, t_end, n_points, chunk_points, method,
+                              start)
+        return iter_tellurium(self._load_model(initial_state), t_end, n_points,
+                              chunk_points, SELECTIONS, start)
     
-    def plot_3d(self, solutions):
-        """3D vizualizacija"""
+    def poincare(self, section, initial_state=[0.1, 0.0, 0.0], t_end=500, transient=0.0,
+                 **options):
+        """Prečkanja Poincaréjevega preseka section (poincare.Section)
+
+        Prečkanja se poiščejo med integracijo, zato se trajektorija ne
+        shranjuje; initial_state je lahko paket oblike (n, 3). Vrne
+        poincare.Crossings, options se podajo poincare.iter_crossings.
+        """
+        return poincare_section(self.rhs, initial_state, t_end, section, transient, **options)
+
+    @instrument.timed('plot')
+    def plot_3d(self, solutions, mode='scatter', bins=800, norm='log', extent=None,
+                show=True):
+        """3D vizualizacija
+
+        mode='density' točke projicira in zbere v sliko gostote bins x bins
+        (norm 'log' ali 'eq'); solutions je lahko tudi tok kosov iz solve_iter,
+        pri katerem je smiselno podati projicirani extent.
+        """
+        import matplotlib.pyplot as plt
+        if mode == 'density':
+            raster = rasterize(solutions, bins=(bins, bins), extent=extent, elev=30, azim=-60)
+            fig, ax = plt.subplots(figsize=(10, 8))
+            plot_density(raster, ax=ax, norm=norm, title='Aizawa atraktor')
+            plt.tight_layout()
+            if show:
+                plt.show()
+            return fig
+
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111, projection='3d')
         #print(solutions.shape)
         # colors = [((1 - i/len(solutions[0]))**2,0.5, (i/len(solutions[0]))**0.5) for i in range(len(solutions[0])) ]
         for solution in solutions:
             #print(type(solutions))
-            ax.scatter(solution[:, 0], solution[:, 2], solution[:, 1], 
+            ax.scatter(solution[:, 0], solution[:, 1], solution[:, 2], 
                     linewidth=0.5, s=1, alpha=0.3, color="tab:blue")
         ax.set_xlabel('X')
         ax.set_ylabel('Y')
         ax.set_zlabel('Z')
         ax.set_title('Aizawa atraktor')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_time_series(self, t, solution):
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, show=True):
         """Časovni potek"""
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(3, 1, figsize=(10, 6))
         labels = ['X', 'Y', 'Z']
         for i, (ax, label) in enumerate(zip(axes, labels)):
@@ -74,18 +210,20 @@ class AizawaAttractor:
             ax.grid(True, alpha=0.3)
         axes[-1].set_xlabel('Čas')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 if __name__ == "__main__":
     print("Aizawa atraktor - simulacija")
     
     brusselator = AizawaAttractor(gridx=1, gridy=1)
-    ts, solutions = brusselator.solve(t_end=1000, n_points=200000)
+    result = brusselator.solve(t_end=1000, n_points=200000)
     
-    print(f"Simulirano {len(ts)} točk")
-    brusselator.plot_3d(solutions)
-    brusselator.plot_time_series(ts[0], solutions[0])
+    print(f"Simulirano {result.n_points} točk")
+    brusselator.plot_3d(result)
+    brusselator.plot_time_series(result.t, result[0])
 
 #     r = te.loada ('''
 
@@ -0,0 +1,273 @@
+"""Basins of attraction on large grids of initial conditions.
+
+A rectangle of the initial-condition plane (two state variables varied, the
+others fixed) is sampled on a ``ny x nx`` grid and cut into square tiles.
+Every tile is integrated as one NumPy batch with a fixed-step RK4 that keeps
+no trajectory: it only tracks, per point,
+
+* divergence - the state left the ball of radius ``escape`` or became
+  non-finite; such points are dropped from the batch at once,
+* fixed points - ``max |rhs(y)|`` stayed below ``ftol`` for ``hold``
+  consecutive checks; these points are dropped from the batch too, and
+* the running minima and maxima of the state over the two halves of the
+  final ``window``. Points still in the batch at ``t_end`` are limit cycles
+  if both halves have the same extent, fixed points if the extent is below
+  ``atol`` (slow spirals) and ``UNRESOLVED`` otherwise (long transients or
+  chaos).
+
+Tiles are spread over a process pool and written by the parent into
+memory-mapped ``.npy`` files in the output directory:
+
+* ``kind.npy`` - ``(ny, nx)`` uint8 codes (:data:`KINDS`),
+* ``center.npy`` - ``(ny, nx, dim)`` float32, the fixed point or the
+  mid-range of the cycle, used by :func:`label_attractors` to tell
+  coexisting attractors apart,
+* ``done.npy`` - one flag per tile, set only after the tile's data is
+  flushed, and ``meta.json`` with the map settings.
+
+Running :func:`map_basins` again with the same settings computes only the
+tiles whose flag is not set, so an interrupted map resumes where it stopped.
+"""
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from tqdm import tqdm
+
+import instrument
+
+UNFINISHED, FIXED_POINT, LIMIT_CYCLE, DIVERGED, UNRESOLVED = range(5)
+KINDS = ('unfinished', 'fixed_point', 'limit_cycle', 'diverged', 'unresolved')
+
+BasinMap = namedtuple('BasinMap', ['x', 'y', 'kind', 'center', 'done'])
+BasinMap.__doc__ = """A basin map on disk.
+
+``x`` and ``y`` are the grid coordinates, ``kind`` and ``center`` the
+memory-mapped classification and ``done`` the per-tile completion flags.
+"""
+
+
+def plane_states(base, axes, x, y):
+    """States ``(len(y) * len(x), dim)`` with ``state[axes]`` on the grid ``x, y``."""
+    base = np.asarray(base, dtype=float)
+    states = np.empty((len(y), len(x), len(base)))
+    states[...] = base
+    states[..., axes[0]] = np.asarray(x)[None, :]
+    states[..., axes[1]] = np.asarray(y)[:, None]
+    return states.reshape(-1, len(base))
+
+
+def classify(rhs, y0, t_end, dt=0.05, window=None, ftol=1e-6, hold=3, atol=1e-4,
+             rtol=1e-2, escape=1e6, check_every=20):
+    """Integrate the batch ``y0`` and classify where every member ends up.
+
+    ``window`` (default ``t_end / 4``) is the final stretch over which cycles
+    are measured; it should span several periods. Returns ``(kind, center)``
+    with the codes of :data:`KINDS` and the fixed point or cycle mid-range.
+    """
+    y = np.array(y0, dtype=float)
+    n, dim = y.shape
+    kind = np.full(n, UNFINISHED, dtype=np.uint8)
+    center = np.full((n, dim), np.nan)
+    window = 0.25 * t_end if window is None else float(window)
+
+    n_steps = max(1, int(np.ceil(t_end / dt - 1e-12)))
+    h = t_end / n_steps
+    window_start = n_steps - max(2, int(round(window / h)))
+    half = (window_start + n_steps) // 2
+    # Running extrema over the two halves of the window, (2, n, dim).
+    lo = np.full((2, n, dim), np.inf)
+    hi = np.full((2, n, dim), -np.inf)
+
+    active = np.arange(n)
+    below = np.zeros(n, dtype=int)
+    t = 0.0
+    steps = 0
+    with np.errstate(over='ignore', invalid='ignore'):
+        for step in range(n_steps):
+            k1 = rhs(t, y)
+            k2 = rhs(t + 0.5 * h, y + 0.5 * h * k1)
+            k3 = rhs(t + 0.5 * h, y + 0.5 * h * k2)
+            k4 = rhs(t + h, y + h * k3)
+            y += (h / 6.0) * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+            t += h
+            steps += 1
+            if step >= window_start:
+                part = int(step >= half)
+                np.minimum(lo[part], y, out=lo[part])
+                np.maximum(hi[part], y, out=hi[part])
+
+            if (step + 1) % check_every and step + 1 < n_steps:
+                continue
+            f = rhs(t, y)
+            diverged = ~(np.abs(y).max(axis=1) < escape)
+            still = np.abs(f).max(axis=1) < ftol
+            below = np.where(still, below + 1, 0)
+            fixed = (below >= hold) & ~diverged
+            drop = diverged | fixed
+            if not drop.any():
+                continue
+            kind[active[diverged]] = DIVERGED
+            kind[active[fixed]] = FIXED_POINT
+            center[active[fixed]] = y[fixed]
+            keep = ~drop
+            active, y, below = active[keep], y[keep], below[keep]
+            lo, hi = lo[:, keep], hi[:, keep]
+            if not len(active):
+                break
+    instrument.count('basins.points', n)
+    instrument.count('rk4.steps', steps)
+
+    if len(active):
+        extent = hi - lo                                    # (2, m, dim)
+        scale = np.maximum(extent.max(axis=0), atol)
+        settled = np.abs(extent[0] - extent[1]).max(axis=1) <= rtol * scale.max(axis=1)
+        small = extent[1].max(axis=1) < atol
+        kind[active] = np.where(small, FIXED_POINT,
+                                np.where(settled, LIMIT_CYCLE, UNRESOLVED))
+        center[active] = np.where(small[:, None], y, 0.5 * (lo[1] + hi[1]))
+    return kind, center
+
+
+def _map_tile(rhs, base, axes, x, y, options):
+    kind, center = classify(rhs, plane_states(base, axes, x, y), **options)
+    return kind.reshape(len(y), len(x)), center.reshape(len(y), len(x), -1)
+
+
+def _tiles(shape, tile):
+    ny, nx = shape
+    return [(iy, ix, slice(iy * tile, min((iy + 1) * tile, ny)),
+             slice(ix * tile, min((ix + 1) * tile, nx)))
+            for iy in range(-(-ny // tile)) for ix in range(-(-nx // tile))]
+
+
+def _open(out, meta, dim):
+    """Open (or create) the map files in ``out``; returns the memmaps."""
+    shape = (meta['shape'][0], meta['shape'][1])
+    n_tiles = (-(-shape[0] // meta['tile']), -(-shape[1] // meta['tile']))
+    path = os.path.join(out, 'meta.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) != meta:
+                raise ValueError(f"{out} holds a basin map with different settings")
+        return (open_memmap(os.path.join(out, 'kind.npy'), mode='r+'),
+                open_memmap(os.path.join(out, 'center.npy'), mode='r+'),
+                open_memmap(os.path.join(out, 'done.npy'), mode='r+'))
+    os.makedirs(out, exist_ok=True)
+    kind = open_memmap(os.path.join(out, 'kind.npy'), mode='w+', dtype=np.uint8, shape=shape)
+    center = open_memmap(os.path.join(out, 'center.npy'), mode='w+', dtype=np.float32,
+                         shape=shape + (dim,))
+    done = open_memmap(os.path.join(out, 'done.npy'), mode='w+', dtype=np.uint8,
+                       shape=n_tiles)
+    # meta.json is written last: without it the map is started from scratch.
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return kind, center, done
+
+
+@instrument.timed('solve')
+def map_basins(model, x_range, y_range, shape=(1000, 1000), out='basins', base=None,
+               axes=(0, 1), tile=128, t_end=200.0, dt=0.05, workers=None, progress=True,
+               **options):
+    """Classify the initial conditions of ``model`` on a grid, tile by tile.
+
+    The grid spans ``x_range`` and ``y_range`` (inclusive) for the state
+    variables ``axes``; the other variables are taken from ``base``, in the
+    coordinates of ``model.rhs`` (required for more than two variables). ``options`` are passed to
+    :func:`classify`. Returns a :class:`BasinMap` backed by the files in
+    ``out``.
+    """
+    ny, nx = shape
+    x = np.linspace(x_range[0], x_range[1], nx)
+    y = np.linspace(y_range[0], y_range[1], ny)
+    base = np.zeros(2) if base is None else np.asarray(base, dtype=float)
+    options = dict(options, t_end=t_end, dt=dt)
+    meta = {
+        'model': type(model).__name__,
+        'params': {name: value for name, value in vars(model).items()
+                   if isinstance(value, (int, float))},
+        'x_range': [float(v) for v in x_range], 'y_range': [float(v) for v in y_range],
+        'shape': [int(ny), int(nx)], 'tile': int(tile), 'axes': [int(a) for a in axes],
+        'base': base.tolist(), 'options': options,
+    }
+    meta = json.loads(json.dumps(meta))             # as it is read back on resume
+    kind, center, done = _open(out, meta, len(base))
+
+    todo = [t for t in _tiles((ny, nx), tile) if not done[t[0], t[1]]]
+    with tqdm(total=done.size, initial=done.size - len(todo), disable=not progress) as bar:
+        def finish(tile_index, result):
+            iy, ix, rows, cols = tile_index
+            kind[rows, cols], center[rows, cols] = result
+            kind.flush()
+            center.flush()
+            done[iy, ix] = 1
+            done.flush()
+            bar.update()
+
+        if workers is None or workers == 1:
+            for t in todo:
+                finish(t, _map_tile(model.rhs, base, axes, x[t[3]], y[t[2]], options))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_map_tile, model.rhs, base, axes, x[t[3]], y[t[2]],
+                                       options): t for t in todo}
+                for future in as_completed(futures):
+                    finish(futures[future], future.result())
+    return BasinMap(x, y, kind, center, done)
+
+
+def label_attractors(kind, center, tol=1e-2):
+    """Number the distinct attractors of a map.
+
+    Points of kind ``FIXED_POINT`` or ``LIMIT_CYCLE`` whose centers agree to
+    ``tol`` (max norm) get the same label ``0, 1, ...``; all other points get
+    ``-1``. Returns ``(labels, attractors)`` where ``attractors`` lists
+    ``(kind, center)`` per label.
+    """
+    kind = np.asarray(kind)
+    center = np.asarray(center, dtype=float).reshape(kind.shape + (-1,))
+    labels = np.full(kind.shape, -1, dtype=np.int32)
+    settled = (kind == FIXED_POINT) | (kind == LIMIT_CYCLE)
+    if not settled.any():
+        return labels, []
+    keys = np.column_stack([kind[settled], np.round(center[settled] / tol)])
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+
+    # Rounding may split one attractor over neighbouring cells; merge them.
+    attractors, merged = [], np.empty(len(unique), dtype=np.int32)
+    for i, (k, *cell) in enumerate(unique):
+        point = np.asarray(cell) * tol
+        for label, (other_kind, other) in enumerate(attractors):
+            if other_kind == k and np.abs(other - point).max() <= 2 * tol:
+                merged[i] = label
+                break
+        else:
+            merged[i] = len(attractors)
+            attractors.append((int(k), point))
+    labels[settled] = merged[inverse.ravel()]
+    return labels, attractors
+
+
+@instrument.timed('plot')
+def plot_basins(basin_map, labels=None, show=True):
+    """Image of the attractor labels (or of the kinds if ``labels`` is None)."""
+    import matplotlib.pyplot as plt
+    image = np.asarray(basin_map.kind) if labels is None else labels
+    fig, ax = plt.subplots(figsize=(8, 7))
+    extent = (basin_map.x[0], basin_map.x[-1], basin_map.y[0], basin_map.y[-1])
+    shown = ax.imshow(image, origin='lower', extent=extent, aspect='auto',
+                      cmap='tab10', interpolation='nearest')
+    colorbar = fig.colorbar(shown, ax=ax)
+    if labels is None:
+        colorbar.set_ticks(range(len(KINDS)))
+        colorbar.set_ticklabels(KINDS)
+        shown.set_clim(-0.5, len(KINDS) - 0.5)
+    ax.set_title('Basins of attraction')
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
@@ -0,0 +1,223 @@
+"""Benchmarks for ``solve()`` of all models.
+
+Every case runs in a fresh process so that its peak RSS is its own and no
+compiled model is inherited. For Tellurium runs the model is first compiled
+through :mod:`model_cache` and that build time is reported separately; the
+timed solves then only integrate. Grid runs with ``workers > 1`` compile once
+in every worker process, which is included in their solve time.
+
+    python benchmarks.py --output results.json
+    python benchmarks.py --baseline results.json --tolerance 0.25
+
+With ``--baseline`` the run is compared case by case against stored results
+and the exit status is 1 if any case got slower (or used more memory) than
+the tolerance allows.
+"""
+import argparse
+import fnmatch
+import importlib
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from ensemble import EnsembleResult
+
+Case = namedtuple('Case', ['name', 'module', 'cls', 'params', 'solve', 'structure'])
+Case.__doc__ = """One benchmark: ``module.cls(**params).solve(**solve)``.
+
+``structure`` names the Antimony constant in ``module`` that is compiled for
+Tellurium runs (``None`` if the instance provides ``antimony()``).
+"""
+
+GRID_MODELS = [
+    ('aizawa', 'aizawa', 'AizawaAttractor', 'AIZAWA_MODEL', 50, 2000),
+    ('brusselator', 'brusselator', 'BrusselatorAttractor', 'BRUSSELATOR_MODEL', 50, 2000),
+    ('brusselator_reactions', 'brusselator_reactions', 'BrusselatorAttractor',
+     'BRUSSELATOR_REACTIONS_MODEL', 50, 2000),
+]
+
+
+def default_cases(quick=False):
+    """All benchmark cases; ``quick`` shortens the runs for a smoke test."""
+    scale = 0.1 if quick else 1.0
+    cases = []
+    for backend in ('tellurium', 'numpy'):
+        cases += [
+            Case(f'lorenz/{backend}', 'lorenz_attractor', 'LorenzAttractor', {},
+                 {'t_end': 50 * scale, 'n_points': int(5000 * scale), 'backend': backend},
+                 'LORENZ_MODEL'),
+            Case(f'repressilator/{backend}', 'repressilator', 'Repressilator', {'alpha': 20.0},
+                 {'t_end': 150 * scale, 'n_points': int(5000 * scale), 'backend': backend},
+                 'REPRESSILATOR_MODEL'),
+            Case(f'thomas/{backend}', 'thomas_attractor', 'ThomasAttractor', {},
+                 {'t_end': 500 * scale, 'n_points': int(50000 * scale), 'backend': backend},
+                 'THOMAS_MODEL'),
+        ]
+    for n in (5, 40, 200, 1000):
+        backends = ('tellurium', 'numpy') if n <= 200 else ('numpy',)
+        for backend in backends:
+            cases.append(Case(f'lorenz96/N={n}/{backend}', 'lorenz96_model', 'Lorenz96',
+                              {'N': n, 'T': 30.0 * scale}, {'backend': backend}, None))
+    for name, module, cls, structure, t_end, n_points in GRID_MODELS:
+        solve = {'t_end': t_end * scale, 'n_points': int(n_points * scale)}
+        for workers in (1, 4):
+            cases.append(Case(f'{name}/tellurium/workers={workers}', module, cls, {},
+                              dict(solve, backend='tellurium', workers=workers), structure))
+        cases.append(Case(f'{name}/numpy', module, cls, {},
+                          dict(solve, backend='numpy'), structure))
+    return cases
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and its children in MiB."""
+    unit = 1 if sys.platform == 'darwin' else 1024      # ru_maxrss is KiB on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * unit / 1024**2
+
+
+def _output(model, result):
+    """``(n_runs, n_points)`` of a ``solve()`` result."""
+    if hasattr(model, 'states') and model.states is not None:
+        return 1, len(model.time)
+    if isinstance(result, EnsembleResult):
+        return result.n_runs, result.n_points
+    return 1, len(result[0])
+
+
+def run_case(case, repeat=3):
+    """Run one case in the current process and return its measurements."""
+    module = importlib.import_module(case.module)
+    model = getattr(module, case.cls)(**case.params)
+    backend = case.solve.get('backend')
+
+    import_s = build_s = 0.0
+    if backend == 'tellurium':
+        import model_cache
+
+        start = time.perf_counter()
+        import tellurium  # noqa: F401
+        import_s = time.perf_counter() - start
+
+        antimony = getattr(module, case.structure) if case.structure else model.antimony()
+        start = time.perf_counter()
+        model_cache.get_cache().get(antimony)
+        build_s = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = model.solve(**case.solve)
+        times.append(time.perf_counter() - start)
+    n_runs, n_points = _output(model, result)
+    solve_s = min(times)
+
+    return {
+        'name': case.name,
+        'model': case.cls,
+        'backend': backend,
+        'workers': case.solve.get('workers', 1),
+        'params': case.params,
+        'n_runs': n_runs,
+        'n_points': n_points,
+        'import_s': import_s,
+        'build_s': build_s,
+        'solve_s': solve_s,
+        'solve_all_s': times,
+        'points_per_s': n_runs * n_points / solve_s,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_isolated(case, repeat=3):
+    """Run one case in a freshly spawned process."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_case, case, repeat).result()
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Cases slower or larger than ``baseline`` by more than ``tolerance``.
+
+    Returns a list of ``(name, metric, baseline value, new value)``; cases
+    missing from either side are ignored.
+    """
+    previous = {entry['name']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results['results']:
+        old = previous.get(entry['name'])
+        if old is None:
+            continue
+        for metric in ('build_s', 'solve_s', 'peak_rss_mb'):
+            if entry[metric] > old[metric] * (1 + tolerance) and entry[metric] > 1e-3:
+                regressions.append((entry['name'], metric, old[metric], entry[metric]))
+    return regressions
+
+
+def run_benchmarks(cases, repeat=3, progress=True):
+    """Run ``cases`` and return the JSON-serializable report."""
+    results = []
+    for case in cases:
+        entry = run_isolated(case, repeat)
+        results.append(entry)
+        if progress:
+            print(f"{entry['name']:40s} build {entry['build_s']:8.3f} s  "
+                  f"solve {entry['solve_s']:8.3f} s  "
+                  f"{entry['points_per_s']:12.0f} pts/s  "
+                  f"{entry['peak_rss_mb']:7.1f} MiB", file=sys.stderr)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', metavar='PATTERN', action='append',
+                        help='run only cases matching this glob, e.g. "lorenz96/*"')
+    parser.add_argument('--quick', action='store_true', help='short runs for a smoke test')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against stored results')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown (default 0.25)')
+    args = parser.parse_args(argv)
+
+    cases = default_cases(args.quick)
+    if args.only:
+        cases = [case for case in cases
+                 if any(fnmatch.fnmatch(case.name, pattern) for pattern in args.only)]
+    report = run_benchmarks(cases, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name}: {metric} {old:.4g} -> {new:.4g}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Bifurcation diagrams over one model parameter.
+
+The parameter values are split into blocks; every block is integrated as one
+NumPy batch (model parameters may be arrays, see :mod:`integrators`) and the
+blocks are spread over a process pool. Trajectories are streamed in chunks
+and reduced on the fly to local maxima of one variable or to crossings of a
+Poincaré section, so no full trajectory is ever kept. The result is a compact
+``(n_points, 2)`` cloud of ``(parameter value, observed value)`` pairs.
+
+With ``checkpoint`` set, finished blocks are saved after each completion and
+an interrupted sweep resumes from the remaining blocks. The checkpoint also
+records the settings of the sweep, and resuming with other settings raises
+``ValueError``.
+"""
+import copy
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from streaming import iter_numpy
+
+
+def _local_maxima(t, x, transient):
+    """Parabolically refined local maxima along the last axis of ``x``."""
+    y0, y1, y2 = x[:, :-2], x[:, 1:-1], x[:, 2:]
+    mask = (y1 > y0) & (y1 >= y2) & (t[1:-1] >= transient)
+    member, k = np.nonzero(mask)
+    a, b, c = y0[member, k], y1[member, k], y2[member, k]
+    curvature = a - 2 * b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak = np.where(curvature != 0, b - (a - c) ** 2 / (8 * curvature), b)
+    return member, peak
+
+
+def _section_crossings(t, states, variable, section, direction, transient):
+    """Linearly interpolated crossings of ``states[..., index] = level``."""
+    index, level = section
+    s = states[:, :, index] - level
+    s0, s1 = s[:, :-1], s[:, 1:]
+    if direction >= 0:
+        mask = (s0 < 0) & (s1 >= 0)
+    else:
+        mask = (s0 > 0) & (s1 <= 0)
+    mask &= t[1:] >= transient
+    member, k = np.nonzero(mask)
+    frac = s0[member, k] / (s0[member, k] - s1[member, k])
+    v0 = states[member, k, variable]
+    v1 = states[member, k + 1, variable]
+    return member, v0 + frac * (v1 - v0)
+
+
+def _sweep_block(model, param, values, initial_state, transient, t_end, dt,
+                 variable, mode, section, direction, chunk_points, method):
+    model = copy.copy(model)
+    setattr(model, param, np.asarray(values, dtype=float))
+    n_points = int(round(t_end / dt)) + 1
+    y0 = np.broadcast_to(np.asarray(initial_state, dtype=float),
+                         (len(values), len(initial_state))).copy()
+
+    points = []
+    tail_t = tail = None
+    for t, chunk in iter_numpy(model.rhs, y0, t_end, n_points, chunk_points, method):
+        # Keep the last samples of the previous chunk so that extrema and
+        # crossings on chunk boundaries are not lost.
+        if tail is not None:
+            t = np.concatenate([tail_t, t])
+            chunk = np.concatenate([tail, chunk], axis=1)
+        if mode == 'maxima':
+            member, observed = _local_maxima(t, chunk[:, :, variable], transient)
+            tail_t, tail = t[-2:], chunk[:, -2:]
+        else:
+            member, observed = _section_crossings(t, chunk, variable, section,
+                                                  direction, transient)
+            tail_t, tail = t[-1:], chunk[:, -1:]
+        points.append(np.column_stack([np.asarray(values)[member], observed]))
+    return np.concatenate(points)
+
+
+def _settings(model, param, **options):
+    """Settings that determine the points of every block, in JSON form.
+
+    The model is identified by its class and its ``params()``, if it has
+    such a method.
+    """
+    params = model.params() if hasattr(model, 'params') else {}
+    params = {name: np.asarray(value, dtype=float).tolist()
+              for name, value in sorted(params.items()) if name != param}
+    options['initial_state'] = np.asarray(options['initial_state'], dtype=float).tolist()
+    return json.loads(json.dumps(dict(options, model=type(model).__name__, param=param,
+                                      params=params)))
+
+
+def _load_checkpoint(path, values, settings):
+    if path is None or not os.path.exists(path):
+        return {}
+    data = np.load(path)
+    if ('settings' not in data.files or not np.array_equal(data['values'], values)
+            or json.loads(str(data['settings'])) != settings):
+        raise ValueError(f"checkpoint {path} belongs to a different sweep")
+    return {int(block): data['points'][data['block'] == block]
+            for block in data['done']}
+
+
+def _save_checkpoint(path, values, settings, done):
+    blocks = sorted(done)
+    points = [done[block] for block in blocks]
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, values=values, settings=json.dumps(settings),
+             done=np.array(blocks, dtype=int),
+             points=np.concatenate(points) if points else np.empty((0, 2)),
+             block=np.repeat(blocks, [len(p) for p in points]).astype(int))
+    os.replace(tmp, path)
+
+
+def bifurcation_sweep(model, param, values, transient, t_end, initial_state,
+                      dt=0.01, variable=0, mode='maxima', section=None, direction=1,
+                      workers=None, block_size=32, chunk_points=5000, method='rk4',
+                      checkpoint=None, progress=True):
+    """Sweep ``model.<param>`` over ``values`` and return the bifurcation points.
+
+    ``mode='maxima'`` records local maxima of ``state[variable]`` after
+    ``transient``; ``mode='poincare'`` records ``state[variable]`` at crossings
+    of the section ``section=(index, level)`` in the given ``direction``.
+    ``initial_state`` is in the coordinates of ``model.rhs`` (for
+    ``ThomasAttractor`` these are shifted by ``CENTER``).
+
+    Returns an array of shape ``(n, 2)`` with rows ``(value, observed)``.
+    """
+    if mode not in ('maxima', 'poincare'):
+        raise ValueError("mode must be 'maxima' or 'poincare'")
+    if mode == 'poincare' and section is None:
+        raise ValueError("mode='poincare' needs section=(index, level)")
+    if transient >= t_end:
+        raise ValueError("transient must be shorter than t_end")
+
+    values = np.asarray(values, dtype=float)
+    blocks = [values[i:i + block_size] for i in range(0, len(values), block_size)]
+    settings = _settings(model, param, initial_state=initial_state, transient=transient,
+                         t_end=t_end, dt=dt, variable=variable, mode=mode, section=section,
+                         direction=direction, block_size=block_size, method=method)
+    done = _load_checkpoint(checkpoint, values, settings)
+    todo = [i for i in range(len(blocks)) if i not in done]
+    args = (initial_state, transient, t_end, dt, variable, mode, section,
+            direction, chunk_points, method)
+
+    with tqdm(total=len(blocks), initial=len(done), disable=not progress) as bar:
+        def finish(i, points):
+            done[i] = points
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, values, settings, done)
+            bar.update()
+
+        if workers is None or workers == 1:
+            for i in todo:
+                finish(i, _sweep_block(model, param, blocks[i], *args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_sweep_block, model, param, blocks[i], *args): i
+                           for i in todo}
+                for future in as_completed(futures):
+                    finish(futures[future], future.result())
+
+    if not done:
+        return np.empty((0, 2))
+    return np.concatenate([done[i] for i in sorted(done)])
@@ -0,0 +1,163 @@
+"""Command line entry point: ``python -m bioproc run <model> [options]``.
+
+Model modules, Tellurium and matplotlib are imported only when they are
+needed: a NumPy-backend run never loads Tellurium, and matplotlib is only
+loaded when plotting is requested. The time spent starting up, solving and
+plotting is reported at the end of every run.
+"""
+import time
+
+_T_START = time.perf_counter()
+
+import argparse
+import importlib
+import inspect
+import sys
+
+from ensemble import EnsembleResult
+
+MODELS = {
+    'lorenz': ('lorenz_attractor', 'LorenzAttractor'),
+    'repressilator': ('repressilator', 'Repressilator'),
+    'lorenz96': ('lorenz96_model', 'Lorenz96'),
+    'thomas': ('thomas_attractor', 'ThomasAttractor'),
+    'aizawa': ('aizawa', 'AizawaAttractor'),
+    'brusselator': ('brusselator', 'BrusselatorAttractor'),
+}
+
+
+def _parse_param(text):
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    try:
+        value = int(value)
+    except ValueError:
+        value = float(value)
+    return name, value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='bioproc', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='solve one model and print a summary')
+    run.add_argument('model', choices=sorted(MODELS))
+    run.add_argument('-p', '--param', type=_parse_param, action='append', default=[],
+                     metavar='NAME=VALUE', help='constructor argument, e.g. rho=28 or N=1000')
+    run.add_argument('--initial-state', type=float, nargs='+')
+    run.add_argument('--t-end', type=float)
+    run.add_argument('--n-points', type=int)
+    run.add_argument('--backend', choices=['tellurium', 'numpy'])
+    run.add_argument('--method', choices=['rk4', 'dopri5'])
+    run.add_argument('--workers', type=int, help='process pool size for grid models')
+    run.add_argument('--cache', metavar='DIR', help='trajectory cache directory')
+    run.add_argument('--plot', action='store_true', help='show the model plots')
+    run.add_argument('--timings', action='store_true',
+                     help='print per-stage timings, step counts and array sizes')
+    run.add_argument('--profile', action='store_true',
+                     help='also print a cProfile summary and tracemalloc peak')
+    return parser
+
+
+def _solve_kwargs(model, args):
+    options = {
+        'initial_state': args.initial_state,
+        't_end': args.t_end,
+        'n_points': args.n_points,
+        'backend': args.backend,
+        'method': args.method,
+        'workers': args.workers,
+    }
+    accepted = inspect.signature(model.solve).parameters
+    kwargs = {}
+    for name, value in options.items():
+        if value is None:
+            continue
+        if name not in accepted:
+            raise SystemExit(f"bioproc: error: --{name.replace('_', '-')} is not supported "
+                             f"by {args.model}")
+        kwargs[name] = value
+    if args.cache is not None and 'cache' in accepted:
+        from result_cache import ResultCache
+
+        kwargs['cache'] = ResultCache(args.cache)
+    return kwargs
+
+
+def _solve(model, kwargs):
+    """Run ``model.solve`` and return ``(t, states)`` for every model type."""
+    result = model.solve(**kwargs)
+    if hasattr(model, 'states'):          # Lorenz96 keeps results on the instance
+        return model.time, model.states
+    if isinstance(result, EnsembleResult):  # grid models
+        return result.t, result
+    return result
+
+
+def _plot(model, t, states):
+    if isinstance(states, EnsembleResult):
+        model.plot_3d(states)
+        model.plot_time_series(t, states[0])
+    elif hasattr(model, 'states'):
+        model.plot_3d()
+        model.plot_time_series()
+    else:
+        model.plot_3d(states)
+        model.plot_time_series(t, states)
+
+
+def run(args):
+    if args.timings or args.profile:
+        import instrument
+
+        with instrument.Recorder(profile=args.profile, trace_memory=args.profile) as recorder:
+            _run(args)
+        print(recorder.report(), file=sys.stderr)
+    else:
+        _run(args)
+
+
+def _run(args):
+    module_name, class_name = MODELS[args.model]
+    cls = getattr(importlib.import_module(module_name), class_name)
+    model = cls(**dict(args.param))
+    kwargs = _solve_kwargs(model, args)
+    t_ready = time.perf_counter()
+
+    t, states = _solve(model, kwargs)
+    t_solved = time.perf_counter()
+
+    runs = states if isinstance(states, EnsembleResult) else [states]
+    print(f"{args.model}: {len(runs)} run(s), {len(t)} points, t = {t[0]:g}..{t[-1]:g}")
+    dim = runs[0].shape[-1]
+    for i in range(min(dim, 10)):
+        lo = min(float(run[..., i].min()) for run in runs)
+        hi = max(float(run[..., i].max()) for run in runs)
+        print(f"  x[{i}]: [{lo:.3f}, {hi:.3f}]")
+    if dim > 10:
+        print(f"  ... {dim - 10} more variables")
+
+    t_plot = 0.0
+    if args.plot:
+        if not hasattr(model, 'plot_3d'):
+            print(f"{args.model} has no plots")
+        else:
+            t0 = time.perf_counter()
+            _plot(model, t, states)
+            t_plot = time.perf_counter() - t0
+
+    backends = [name for name in ('tellurium', 'matplotlib') if name in sys.modules]
+    print(f"startup {1e3 * (t_ready - _T_START):.1f} ms, "
+          f"solve {t_solved - t_ready:.3f} s, plot {t_plot:.3f} s "
+          f"(loaded: {', '.join(backends) or 'numpy only'})", file=sys.stderr)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'run':
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
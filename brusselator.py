@@ -1,8 +1,25 @@
-import tellurium as te
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import random
 
+import numpy as np
+
+import instrument
+import model_cache
+from convergence import integrate_until_converged, stream_until_converged
+from ensemble import EnsembleResult, integrate_batch, run_ensemble
+from integrators import check_backend
+from streaming import iter_tellurium
+
+
+BRUSSELATOR_MODEL = '''
+model brusselator
+    x' = a + x * x * y - b * x - x
+    y' = b * x - x * x * y
+
+    a = 1; b = 1
+    x = 1; y = 1
+end
+'''
+
 
 class BrusselatorAttractor:
     """Brusselator - kaotični sistem"""
@@ -12,37 +29,107 @@ class BrusselatorAttractor:
         self.b = b
         self.gridx = gridx
         self.gridy = gridy
-    
-    def solve(self, initial_state=[1.0, 1.0], t_end=50, n_points=2000):
-        """Reši sistem z Tellurium"""
+
+    def params(self):
+        """Parametri modela kot slovar"""
+        return {'a': self.a, 'b': self.b}
+
+    def rhs(self, t, state):
+        """Desna stran sistema za NumPy integratorje, state ima obliko (..., 2)"""
+        x, y = state[..., 0], state[..., 1]
+        return np.stack([
+            self.a + x * x * y - self.b * x - x,
+            self.b * x - x * x * y,
+        ], axis=-1)
+
+    def jacobian(self, state):
+        """Jacobijeva matrika desne strani v stanju state (oblika (2,))"""
+        x, y = state
+        return np.array([
+            [2 * x * y - self.b - 1, x * x],
+            [self.b - 2 * x * y, -x * x],
+        ])
+
+    def dfdp(self, state, name):
+        """Odvod desne strani po parametru name ('a' ali 'b')"""
+        x, y = state
+        if name == 'a':
+            return np.array([1.0, 0.0])
+        if name == 'b':
+            return np.array([-x, x])
+        raise ValueError(f"neznan parameter {name!r}")
+
+    def grid_states(self, initial_state):
+        """Začetni pogoji na mreži gridx x gridy s korakom 0.2"""
+        x0, y0 = initial_state
+        return [(x0 + (r//self.gridy) * 0.2, y0 + (r%self.gridy) * 0.2)
+                for r in range(self.gridx * self.gridy)]
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[1.0, 1.0], t_end=50, n_points=2000, workers=None,
+              backend='tellurium', method='dopri5', dtype=None):
+        """Reši sistem z Tellurium za vse začetne pogoje na mreži
+
+        workers > 1 porazdeli simulacije med procese, backend='numpy' pa
+        vse začetne pogoje reši hkrati kot en paket. Vrne EnsembleResult s
+        skupnim časom in stanji oblike (n_runs, n_points, dim); dtype
+        (npr. np.float32) določi tip shranjenih stanj.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            y0 = np.array(self.grid_states(initial_state), dtype=float)
+            t, states = integrate_batch(self.rhs, y0, t_end, n_points, method, dtype)
+            return EnsembleResult(t, states, y0, {'a': self.a, 'b': self.b})
+
+        grid = self.grid_states(initial_state)
+        t, states = run_ensemble(self._solve_one, grid, workers=workers, dtype=dtype,
+                                 t_end=t_end, n_points=n_points)
+        return EnsembleResult(t, states, grid, {'a': self.a, 'b': self.b})
+
+    @instrument.timed('solve')
+    def converge(self, initial_state=[1.0, 1.0], t_max=1000, dt=0.05, chunk_time=50,
+                 backend='tellurium', method='dopri5', **options):
+        """Za vse začetne pogoje na mreži integrira le do ustalitve
+
+        Vrne seznam ConvergenceResult (fiksna točka ali limitni cikel s
+        periodo, amplitudo in časom ustalitve). options se podajo
+        ConvergenceMonitor-ju.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            y0 = np.array(self.grid_states(initial_state), dtype=float)
+            return integrate_until_converged(self, y0, t_max, dt, chunk_time, method,
+                                             **options)
+
+        n_points = int(round(t_max / dt)) + 1
+        results = []
+        for x0, y0 in self.grid_states(initial_state):
+            model = model_cache.load(BRUSSELATOR_MODEL, {
+                'a': self.a, 'b': self.b, 'x': x0, 'y': y0,
+            })
+            chunks = iter_tellurium(model, t_max, n_points, int(round(chunk_time / dt)))
+            results.append(stream_until_converged(self.rhs, chunks, **options))
+        return results
+
+    def _solve_one(self, initial_state, t_end, n_points):
+        """Reši sistem za en začetni pogoj"""
         x0, y0 = initial_state
-        
-        
         # model.integrator = 'gillespie'
         # model.integrator.seed = 1234
-        solutions = []
-        ts = []
-        for r in tqdm(range(self.gridx * self.gridy)):
-            x0, y0 = initial_state
-            x0 += (r//self.gridy) * 0.2
-            y0 += (r%self.gridy) * 0.2
-            model = te.loada(f'''
-            model brusselator
-                x' = {self.a} + x * x * y - {self.b} * x - x
-                y' = {self.b} * x - x * x * y
-                
-                x = {x0}; y = {y0}
-            end
-        ''')
+        model = model_cache.load(BRUSSELATOR_MODEL, {
+            'a': self.a, 'b': self.b, 'x': x0, 'y': y0,
+        })
+        with instrument.stage('integrate'):
             result = model.simulate(0, t_end, n_points)
-            t = result[:, 0]
-            solution = result[:, 1:]
-            solutions.append(solution)
-            ts.append(t)
-        return ts, solutions
+        instrument.record_array('integrate', result)
+        t = result[:, 0]
+        solution = result[:, 1:]
+        return t, solution
     
-    def plot_3d(self, solutions):
+    @instrument.timed('plot')
+    def plot_3d(self, solutions, show=True):
         """3D vizualizacija"""
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111)
         #print(solutions.shape)
@@ -55,10 +142,14 @@ class BrusselatorAttractor:
         ax.set_ylabel('Y')
         ax.set_title('Brusselator atraktor')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_time_series(self, t, solution):
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, show=True):
         """Časovni potek"""
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(2, 1, figsize=(10, 6))
         labels = ['X', 'Y']
         for i, (ax, label) in enumerate(zip(axes, labels)):
@@ -67,18 +158,20 @@ class BrusselatorAttractor:
             ax.grid(True, alpha=0.3)
         axes[-1].set_xlabel('Čas')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 if __name__ == "__main__":
     print("Brusselator atraktor - simulacija")
     
     brusselator = BrusselatorAttractor(a=1, b=3, gridx=10, gridy=16)
-    ts, solutions = brusselator.solve(t_end=20, initial_state=[0.5, 1.0], n_points=500)
+    result = brusselator.solve(t_end=20, initial_state=[0.5, 1.0], n_points=500)
     
-    print(f"Simulirano {len(ts)} točk")
-    brusselator.plot_3d(solutions)
-    brusselator.plot_time_series(ts[0], solutions[0])
+    print(f"Simulirano {result.n_points} točk")
+    brusselator.plot_3d(result)
+    brusselator.plot_time_series(result.t, result[0])
 
 #     r = te.loada ('''
 
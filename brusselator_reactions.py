@@ -1,8 +1,36 @@
-import tellurium as te
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import random
 
+import numpy as np
+
+import instrument
+import model_cache
+from convergence import integrate_until_converged, stream_until_converged
+from ensemble import EnsembleResult, integrate_batch, run_ensemble
+from integrators import check_backend
+from streaming import iter_tellurium
+from stochastic import ensemble_statistics, gillespie
+
+
+BRUSSELATOR_REACTIONS_MODEL = '''
+model brusselator
+    $A -> X;         A
+    2 X + Y -> 3 X; k*X*X*Y
+    $B + X -> Y + D; B*X
+    X -> ;         X
+
+    A = 1; B = 1; k = 1;
+    X = 1; Y = 1;
+end
+'''
+
+# Sprememba števila molekul (X, Y, D) za vsako od štirih reakcij
+STOICHIOMETRY = np.array([
+    [1, 0, 0],     # $A -> X
+    [1, -1, 0],    # 2 X + Y -> 3 X
+    [-1, 1, 1],    # $B + X -> Y + D
+    [-1, 0, 0],    # X ->
+])
+
 
 class BrusselatorAttractor:
     """Brusselator - kaotični sistem"""
@@ -13,41 +41,153 @@ class BrusselatorAttractor:
         self.gridx = gridx
         self.gridy = gridy
     
-    def solve(self, initial_state=[1.0, 1.0], t_end=50, n_points=2000):
-        """Reši sistem z Tellurium"""
+    def rhs(self, t, state):
+        """Masni zakon reakcij za NumPy integratorje, state = (X, Y, D)"""
+        X, Y = state[..., 0], state[..., 1]
+        v1 = self.a            # $A -> X
+        v2 = X * X * Y         # 2 X + Y -> 3 X
+        v3 = self.b * X        # $B + X -> Y + D
+        v4 = X                 # X ->
+        return np.stack([v1 + v2 - v3 - v4, v3 - v2, v3], axis=-1)
+
+    def grid_states(self, initial_state):
+        """Začetni pogoji na mreži gridx x gridy s korakom 0.2"""
         x0, y0 = initial_state
-        
-        
-        # model.integrator = 'gillespie'
-        # model.integrator.seed = 1234
-        solutions = []
-        ts = []
-        for r in tqdm(range(self.gridx * self.gridy)):
-            x0, y0 = initial_state
-            x0 += (r//self.gridy) * 0.2
-            y0 += (r%self.gridy) * 0.2
-            model = te.loada(f'''
-            model brusselator
-                
-                $A -> X;         A
-                2 X + Y -> 3 X; X*X*Y
-                $B + X -> Y + D; B*X
-                X -> ;         X
-                
-
-                A = {self.a}; B = {self.b};
-                X = {x0}; Y = {y0}; 
-            end
-        ''')
+        return [(x0 + (r//self.gridy) * 0.2, y0 + (r%self.gridy) * 0.2)
+                for r in range(self.gridx * self.gridy)]
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[1.0, 1.0], t_end=50, n_points=2000, workers=None,
+              backend='tellurium', method='dopri5', dtype=None):
+        """Reši sistem z Tellurium za vse začetne pogoje na mreži
+
+        workers > 1 porazdeli simulacije med procese, backend='numpy' pa
+        vse začetne pogoje reši hkrati kot en paket. Vrne EnsembleResult s
+        skupnim časom in stanji oblike (n_runs, n_points, dim); dtype
+        (npr. np.float32) določi tip shranjenih stanj.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            xy0 = np.array(self.grid_states(initial_state), dtype=float)
+            y0 = np.column_stack([xy0, np.zeros(len(xy0))])  # D = 0
+            t, states = integrate_batch(self.rhs, y0, t_end, n_points, method, dtype)
+            return EnsembleResult(t, states, y0, {'a': self.a, 'b': self.b})
+
+        grid = self.grid_states(initial_state)
+        t, states = run_ensemble(self._solve_one, grid, workers=workers, dtype=dtype,
+                                 t_end=t_end, n_points=n_points)
+        return EnsembleResult(t, states, grid, {'a': self.a, 'b': self.b})
+
+    @instrument.timed('solve')
+    def converge(self, initial_state=[1.0, 1.0], t_max=1000, dt=0.05, chunk_time=50,
+                 backend='tellurium', method='dopri5', **options):
+        """Za vse začetne pogoje na mreži integrira le do ustalitve
+
+        Vrne seznam ConvergenceResult (fiksna točka ali limitni cikel s
+        periodo, amplitudo in časom ustalitve). options se podajo
+        ConvergenceMonitor-ju. D le narašča, zato se preverjata samo X in Y.
+        """
+        check_backend(backend)
+        options.setdefault('variables', [0, 1])
+        if backend == 'numpy':
+            y0 = np.array(self.grid_states(initial_state), dtype=float)
+            y0 = np.column_stack([y0, np.zeros(len(y0))])  # D = 0
+            return integrate_until_converged(self, y0, t_max, dt, chunk_time, method,
+                                             **options)
+
+        n_points = int(round(t_max / dt)) + 1
+        results = []
+        for x0, y0 in self.grid_states(initial_state):
+            model = model_cache.load(BRUSSELATOR_REACTIONS_MODEL, {
+                'A': self.a, 'B': self.b, 'X': x0, 'Y': y0,
+            })
+            chunks = iter_tellurium(model, t_max, n_points, int(round(chunk_time / dt)))
+            results.append(stream_until_converged(self.rhs, chunks, **options))
+        return results
+
+    def _solve_one(self, initial_state, t_end, n_points):
+        """Reši sistem za en začetni pogoj"""
+        x0, y0 = initial_state
+        model = model_cache.load(BRUSSELATOR_REACTIONS_MODEL, {
+            'A': self.a, 'B': self.b, 'X': x0, 'Y': y0,
+        })
+        with instrument.stage('integrate'):
             result = model.simulate(0, t_end, n_points)
-            t = result[:, 0]
-            solution = result[:, 1:]
-            solutions.append(solution)
-            ts.append(t)
-        return ts, solutions
+        instrument.record_array('integrate', result)
+        t = result[:, 0]
+        solution = result[:, 1:]
+        return t, solution
     
-    def plot_3d(self, solutions):
+    def propensities(self, counts, volume):
+        """Hitrosti reakcij za število molekul pri prostornini volume
+
+        Enaki zakoni kot v modelu (tudi RoadRunnerjev Gillespie jih računa
+        tako): dotok A in trimolekularna reakcija sta skalirana z volume.
+        """
+        X, Y = counts[..., 0], counts[..., 1]
+        return np.stack([
+            np.full(X.shape, self.a * volume),
+            X * X * Y / volume**2,
+            self.b * X,
+            X,
+        ], axis=-1)
+
+    def simulate_ssa(self, n, seed, initial_state=[1.0, 1.0], t_end=50, n_points=2000,
+                     volume=100, backend='numpy'):
+        """n realizacij Gillespiejevega algoritma, vrne (t, koncentracije)
+
+        Koncentracije so števila molekul deljena z volume, oblike
+        (n, n_points, 3) za (X, Y, D). seed je np.random.SeedSequence.
+        """
+        check_backend(backend)
+        t = np.linspace(0, t_end, n_points)
+        x0, y0 = initial_state
+        counts = np.array([round(x0 * volume), round(y0 * volume), 0], dtype=float)
+        if backend == 'numpy':
+            rng = np.random.default_rng(seed)
+            x = np.broadcast_to(counts, (n, 3))
+            samples = gillespie(lambda c: self.propensities(c, volume), STOICHIOMETRY,
+                                x, t, rng)
+            return t, samples / volume
+
+        samples = np.empty((n, n_points, 3))
+        model = model_cache.load(BRUSSELATOR_REACTIONS_MODEL)
+        try:
+            model.integrator = 'gillespie'
+            model.integrator.variable_step_size = False
+            for i, run_seed in enumerate(seed.generate_state(n)):
+                model_cache.load(BRUSSELATOR_REACTIONS_MODEL, {
+                    'A': self.a * volume, 'B': self.b, 'k': 1 / volume**2,
+                    'X': counts[0], 'Y': counts[1],
+                })
+                model.integrator.seed = int(run_seed)
+                with instrument.stage('integrate'):
+                    samples[i] = model.simulate(0, t_end, n_points)[:, 1:]
+        finally:
+            # Model je v predpomnilniku, deterministične simulacije rabijo CVODE.
+            model.integrator = 'cvode'
+        return t, samples / volume
+
+    @instrument.timed('solve')
+    def solve_stochastic(self, n_realizations=1000, initial_state=[1.0, 1.0], t_end=50,
+                         n_points=2000, volume=100, seed=0, workers=None, backend='numpy',
+                         block_size=256, quantiles=(0.05, 0.5, 0.95), **options):
+        """Stohastični ansambel z Gillespiejevim algoritmom
+
+        Realizacije se sproti združujejo v povprečje, varianco in kvantile
+        (glej stochastic.ensemble_statistics), zato poraba pomnilnika ni
+        odvisna od n_realizations. Vrne StochasticSummary.
+        """
+        return ensemble_statistics(self.simulate_ssa, n_realizations, seed=seed,
+                                   workers=workers, block_size=block_size,
+                                   quantiles=quantiles, initial_state=initial_state,
+                                   t_end=t_end, n_points=n_points, volume=volume,
+                                   backend=backend, **options)
+
+    @instrument.timed('plot')
+    def plot_3d(self, solutions, show=True):
         """3D vizualizacija"""
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111)
         #print(solutions.shape)
@@ -60,10 +200,14 @@ class BrusselatorAttractor:
         ax.set_ylabel('Y')
         ax.set_title('Brusselator atraktor')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_time_series(self, t, solution):
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, show=True):
         """Časovni potek"""
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(2, 1, figsize=(10, 6))
         labels = ['X', 'Y']
         for i, (ax, label) in enumerate(zip(axes, labels)):
@@ -72,18 +216,20 @@ class BrusselatorAttractor:
             ax.grid(True, alpha=0.3)
         axes[-1].set_xlabel('Čas')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 if __name__ == "__main__":
     print("Brusselator atraktor - simulacija")
     
     brusselator = BrusselatorAttractor(a=1, b=3, gridx=5, gridy=5)
-    ts, solutions = brusselator.solve(t_end=20, initial_state=[0.5, 1.0], n_points=500)
+    result = brusselator.solve(t_end=20, initial_state=[0.5, 1.0], n_points=500)
     
-    print(f"Simulirano {len(ts)} točk")
-    brusselator.plot_3d(solutions)
-    brusselator.plot_time_series(ts[0], solutions[0])
+    print(f"Simulirano {result.n_points} točk")
+    brusselator.plot_3d(result)
+    brusselator.plot_time_series(result.t, result[0])
 
 #     r = te.loada ('''
 
@@ -0,0 +1,119 @@
+"""Checkpoints for long streamed integrations.
+
+A run streamed into a ``.npy`` file by :func:`streaming.save_npy` can record
+its progress in a JSON checkpoint: the settings of the run (model,
+parameters, initial state, time grid, backend, method, chunk size, output
+file) and the number of rows written with the time and state of the last
+one. The checkpoint is replaced atomically and only after the rows it
+covers are flushed, so after a crash the output is complete up to the
+checkpoint and at most one checkpoint interval of work is lost.
+
+Resuming restarts the stream at the checkpointed row from the stored state.
+Checkpoints fall on chunk boundaries and every chunk is integrated from the
+last state of the previous one (see :mod:`streaming`), so a resumed run
+writes the same rows as an uninterrupted one. ``extend_to`` carries a
+single trajectory on past its end time with the same time step; the
+``.npy`` file is grown in place.
+"""
+import json
+import os
+import time
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+
+def _normalize(data):
+    """``data`` as it reads back from JSON."""
+    return json.loads(json.dumps(data))
+
+
+def run_info(model, params, initial_state, t_end, n_points, chunk_points, backend, method,
+             out):
+    """Settings of a streamed run, as stored in its checkpoints."""
+    return _normalize({
+        'model': model, 'params': params,
+        'initial_state': np.asarray(initial_state, dtype=float).tolist(),
+        't_end': float(t_end), 'n_points': int(n_points), 'chunk_points': int(chunk_points),
+        'backend': backend, 'method': method, 'out': os.path.abspath(out),
+    })
+
+
+class Checkpointer:
+    """Saves the progress of a run to ``path`` at most every ``every`` seconds."""
+
+    def __init__(self, path, info, every=60.0):
+        self.path = path
+        self.info = info
+        self.every = float(every)
+        self._last = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self._last >= self.every
+
+    def save(self, index, t, state):
+        """Record that rows ``[0, index)`` are written, the last one at ``(t, state)``."""
+        data = dict(self.info, index=int(index), t=float(t),
+                    state=np.asarray(state, dtype=float).tolist())
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._last = time.monotonic()
+
+
+def grow_npy(path, n_rows):
+    """Grow the first axis of the C-ordered ``.npy`` file ``path`` to ``n_rows`` in place.
+
+    The header is rewritten within its existing padding, so the data do not
+    move.
+    """
+    with open(path, 'r+b') as f:
+        version = npy_format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+            prefix = npy_format.MAGIC_LEN + 2
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+            prefix = npy_format.MAGIC_LEN + 4
+        offset = f.tell()
+        if fortran_order:
+            raise ValueError(f"{path} is Fortran-ordered and cannot grow in place")
+        if n_rows < shape[0]:
+            raise ValueError(f"{path} already has {shape[0]} rows")
+        header = repr({'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': False,
+                       'shape': (n_rows,) + tuple(shape[1:])})
+        space = offset - prefix - 1
+        if len(header) > space:
+            raise ValueError(f"the header of {path} has no room for the new shape")
+        f.seek(prefix)
+        f.write((header.ljust(space) + '\n').encode('latin1'))
+        f.truncate(offset + n_rows * int(np.prod(shape[1:], dtype=int)) * dtype.itemsize)
+
+
+def resume(path, model, params, extend_to=None):
+    """Settings, next row and last state of the run recorded in checkpoint ``path``.
+
+    Raises ``ValueError`` if the checkpoint belongs to another model or
+    parameter set. With ``extend_to`` the run is lengthened to that end time
+    on its time step and its output file grown accordingly.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if data['model'] != model or data['params'] != _normalize(params):
+        raise ValueError(f"checkpoint {path} belongs to a different model or parameters")
+    state = np.array(data['state'])
+    info = {key: value for key, value in data.items() if key not in ('index', 't', 'state')}
+    if extend_to is not None:
+        dt = info['t_end'] / (info['n_points'] - 1)
+        n_points = int(round(extend_to / dt)) + 1
+        if n_points < info['n_points']:
+            raise ValueError(f"extend_to={extend_to} is before the end of the run")
+        if state.ndim > 1:
+            raise ValueError("only single trajectories can be extended")
+        info['t_end'] = (n_points - 1) * dt
+        info['n_points'] = n_points
+        grow_npy(info['out'], n_points)
+    return info, data['index'], state
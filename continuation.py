@@ -0,0 +1,221 @@
+"""Pseudo-arclength continuation of equilibria in one parameter.
+
+A branch of steady states ``f(x, p) = 0`` is traced as a curve in ``(x, p)``
+space, parametrized by arclength, so it can be followed around folds where
+``p`` turns back. Every step predicts along the unit tangent and corrects
+with Newton's method on the system extended by the arclength condition,
+using the model's analytic ``jacobian(state)`` and ``dfdp(state, name)``
+(see :class:`repressilator.Repressilator`, :class:`toggle_switch.ToggleSwitch`
+and :class:`brusselator.BrusselatorAttractor`).
+
+Along the branch two test functions are monitored:
+
+* fold - the ``p`` component of the tangent changes sign,
+* Hopf - the real part of the complex eigenvalue pair closest to the
+  imaginary axis changes sign.
+
+A sign change is located by regula falsi (Illinois) on the arclength
+between the two bracketing points, each trial point being corrected onto
+the branch, so a bifurcation point is found to ``tol`` with a few dozen
+small linear solves instead of a sweep of simulations.
+"""
+import copy
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import instrument
+
+SpecialPoint = namedtuple('SpecialPoint', ['kind', 'index', 'value', 'state', 'eigenvalues'])
+SpecialPoint.__doc__ = """A fold (``kind='fold'``) or Hopf point, found after branch point ``index``."""
+
+Branch = namedtuple('Branch', ['name', 'values', 'states', 'stable', 'eigenvalues', 'points'])
+Branch.__doc__ = """A continued branch of equilibria.
+
+``values`` ``(n,)`` and ``states`` ``(n, dim)`` are the points on the
+branch, ``stable`` marks those whose eigenvalues all have negative real
+part, ``points`` lists the :class:`SpecialPoint` s in branch order.
+"""
+
+
+class _System:
+    """``f(x, p)`` and its derivatives for one parameter of a model."""
+
+    def __init__(self, model, name):
+        self.model = copy.copy(model)
+        self.name = name
+
+    def _set(self, z):
+        setattr(self.model, self.name, float(z[-1]))
+        return z[:-1]
+
+    def f(self, z):
+        return self.model.rhs(0.0, self._set(z))
+
+    def derivatives(self, z):
+        """``(J, f_p)`` at the point ``z = (x, p)``."""
+        x = self._set(z)
+        return self.model.jacobian(x), self.model.dfdp(x, self.name)
+
+
+def _tangent(system, z, previous):
+    """Unit tangent at ``z`` oriented like ``previous``."""
+    J, fp = system.derivatives(z)
+    matrix = np.vstack([np.column_stack([J, fp]), previous])
+    rhs = np.zeros(len(z))
+    rhs[-1] = 1.0
+    t = np.linalg.solve(matrix, rhs)
+    return t / np.linalg.norm(t), J
+
+
+def _correct(system, z, tangent, z_pred, tol, max_iter):
+    """Newton on ``f(z) = 0, tangent . (z - z_pred) = 0``; None if it fails."""
+    for _ in range(max_iter):
+        residual = np.append(system.f(z), tangent @ (z - z_pred))
+        if not np.all(np.isfinite(residual)):
+            return None
+        if np.abs(residual).max() < tol:
+            return z
+        J, fp = system.derivatives(z)
+        matrix = np.vstack([np.column_stack([J, fp]), tangent])
+        try:
+            z = z - np.linalg.solve(matrix, residual)
+        except np.linalg.LinAlgError:
+            return None
+    return z if np.abs(system.f(z)).max() < tol else None
+
+
+def _hopf_test(eigenvalues):
+    """Real part of the complex pair closest to the imaginary axis (NaN if none)."""
+    pair = eigenvalues[np.abs(eigenvalues.imag) > 1e-8]
+    if not len(pair):
+        return math.nan
+    return float(pair.real[np.argmin(np.abs(pair.real))])
+
+
+def _tests(tangent, J):
+    eigenvalues = np.linalg.eigvals(J)
+    return {'fold': tangent[-1], 'hopf': _hopf_test(eigenvalues)}, eigenvalues
+
+
+def _locate(system, kind, z0, t0, h_lo, h_hi, g_lo, g_hi, tol, max_iter):
+    """Regula falsi on the step length ``h`` from ``z0`` for a zero of the test ``kind``."""
+    z = z0
+    side = 0
+    for _ in range(60):
+        h = (h_lo * g_hi - h_hi * g_lo) / (g_hi - g_lo)
+        z_pred = z0 + h * t0
+        z_new = _correct(system, z_pred, t0, z_pred, tol, max_iter)
+        if z_new is None:
+            break
+        z = z_new
+        tangent, J = _tangent(system, z, t0)
+        g = _tests(tangent, J)[0][kind]
+        if not np.isfinite(g) or abs(g) < tol or abs(h_hi - h_lo) < tol * abs(h):
+            break
+        if np.sign(g) == np.sign(g_lo):
+            h_lo, g_lo = h, g
+            if side == 1:
+                g_hi *= 0.5
+            side = 1
+        else:
+            h_hi, g_hi = h, g
+            if side == -1:
+                g_lo *= 0.5
+            side = -1
+    return z
+
+
+@instrument.timed('solve')
+def continuation(model, name, state, value, bounds, ds=0.05, ds_min=1e-6, ds_max=0.5,
+                 max_steps=5000, tol=1e-10, max_iter=8, direction=1):
+    """Trace the equilibria of ``model`` in the parameter ``name`` within ``bounds``.
+
+    Starts at ``name = value`` from the guess ``state``, which is first
+    refined by Newton's method, and follows the branch in the direction of
+    increasing (``direction=1``) or decreasing ``name`` until it leaves
+    ``bounds`` or ``max_steps`` are taken. Returns a :class:`Branch`.
+    """
+    system = _System(model, name)
+    lo, hi = bounds
+    z = np.append(np.asarray(state, dtype=float), float(value))
+    start = np.zeros(len(z))
+    start[-1] = direction
+    z = _correct(system, z, start, z, tol, 50)
+    if z is None:
+        raise RuntimeError(f"Newton did not converge to an equilibrium at {name}={value}")
+    tangent, J = _tangent(system, z, start)
+    tests, eigenvalues = _tests(tangent, J)
+
+    points, spectra, special = [z], [eigenvalues], []
+    steps = 0
+    while steps < max_steps and lo <= z[-1] <= hi:
+        z_pred = z + ds * tangent
+        z_new = _correct(system, z_pred, tangent, z_pred, tol, max_iter)
+        if z_new is None:
+            ds *= 0.5
+            if ds < ds_min:
+                break
+            continue
+        steps += 1
+        tangent_new, J = _tangent(system, z_new, tangent)
+        tests_new, eigenvalues = _tests(tangent_new, J)
+        for kind in ('fold', 'hopf'):
+            g0, g1 = tests[kind], tests_new[kind]
+            if np.isfinite(g0) and np.isfinite(g1) and np.sign(g0) != np.sign(g1):
+                zc = _locate(system, kind, z, tangent, 0.0, ds, g0, g1, tol, max_iter)
+                Jc = system.derivatives(zc)[0]
+                special.append(SpecialPoint(kind, len(points) - 1, float(zc[-1]),
+                                            zc[:-1].copy(), np.linalg.eigvals(Jc)))
+        z, tangent, tests = z_new, tangent_new, tests_new
+        points.append(z)
+        spectra.append(eigenvalues)
+        ds = min(ds * 1.3, ds_max)
+    instrument.count('continuation.steps', steps)
+
+    points = np.array(points)
+    spectra = np.array(spectra)
+    stable = (spectra.real < 0).all(axis=1)
+    return Branch(name, points[:, -1], points[:, :-1], stable, spectra, special)
+
+
+@instrument.timed('plot')
+def plot_branch(branch, variable=0, ax=None, show=True):
+    """Bifurcation diagram: stable parts solid, unstable dashed, special points marked."""
+    import matplotlib.pyplot as plt
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(8, 6))
+    else:
+        fig = ax.figure
+    x = branch.states[:, variable]
+    for stable, style in ((True, '-'), (False, '--')):
+        ax.plot(branch.values, np.where(branch.stable == stable, x, np.nan), style,
+                color='tab:blue')
+    for point in branch.points:
+        marker = 's' if point.kind == 'fold' else 'o'
+        ax.plot(point.value, point.state[variable], marker, color='tab:red')
+        ax.annotate(point.kind, (point.value, point.state[variable]),
+                    textcoords='offset points', xytext=(5, 5))
+    ax.set_xlabel(branch.name)
+    ax.set_ylabel(f'state[{variable}]')
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+if __name__ == "__main__":
+    from repressilator import Repressilator
+    from toggle_switch import ToggleSwitch
+
+    branch = continuation(Repressilator(alpha=1.0, n=3.0), 'alpha', [0.7, 0.7, 0.7], 1.0,
+                          (0.5, 10.0))
+    for point in branch.points:
+        print(f"repressilator: {point.kind} at alpha = {point.value:.6f}")
+
+    branch = continuation(ToggleSwitch(alpha1=1.0, alpha2=5.0), 'alpha1', [0.1, 4.9], 1.0,
+                          (0.5, 10.0))
+    for point in branch.points:
+        print(f"toggle switch: {point.kind} at alpha1 = {point.value:.6f}")
+    plot_branch(branch)
@@ -0,0 +1,221 @@
+"""Early stopping for trajectories that have settled.
+
+:class:`ConvergenceMonitor` looks at a trajectory chunk by chunk and decides,
+per member of a batch, whether it has reached
+
+* a fixed point - the derivative norm ``max |rhs(y)|`` has stayed below
+  ``ftol`` for ``hold`` time units, or
+* a limit cycle - the last ``n_cycles`` periods between upward crossings of
+  the section ``state[index] = level`` agree to ``rtol``, and so do the
+  states at those crossings. ``level`` is the mid-range of ``state[index]``
+  over the monitored window.
+
+:func:`integrate_until_converged` integrates a batch with the NumPy
+integrators chunk by chunk and drops members from the batch as soon as they
+converge, so a parameter scan only pays for the transients.
+:func:`stream_until_converged` does the same for any chunk stream (e.g. a
+Tellurium model through :func:`streaming.iter_tellurium`) and simply stops
+consuming it.
+"""
+import copy
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import instrument
+from integrators import integrate
+
+
+@dataclass
+class ConvergenceResult:
+    """What one trajectory converged to.
+
+    ``kind`` is ``'fixed_point'``, ``'limit_cycle'`` or ``'none'`` if
+    ``t_max`` was reached first. ``t_converged`` is the time from which the
+    behavior was observed (NaN for ``'none'``), ``t_stop`` the time at which
+    integration stopped. ``state`` is the fixed point or the state at the
+    last section crossing; ``amplitude`` holds the half peak-to-peak range of
+    every variable over the last period (zeros for a fixed point).
+    """
+    kind: str
+    t_converged: float
+    t_stop: float
+    period: float = float('nan')
+    amplitude: np.ndarray = field(default_factory=lambda: np.empty(0))
+    state: np.ndarray = field(default_factory=lambda: np.empty(0))
+
+
+class ConvergenceMonitor:
+    """Tracks convergence of ``n`` trajectories fed in as chunks.
+
+    ``rhs`` must match the members passed to :meth:`update` (per-member
+    parameter arrays included). ``variables`` selects the components that are checked (all by default),
+    e.g. to ignore an accumulating species.
+    """
+
+    def __init__(self, rhs, n=1, variables=None, ftol=1e-4, hold=5.0, index=0,
+                 n_cycles=3, rtol=1e-3):
+        self.rhs = rhs
+        self.variables = variables
+        self.ftol = ftol
+        self.hold = hold
+        self.index = index
+        self.n_cycles = n_cycles
+        self.rtol = rtol
+        self.results = [None] * n
+        self._below_since = np.full(n, np.nan)
+        self._t_prev = None
+        self._prev = None
+
+    @property
+    def done(self):
+        """Boolean array, True for members that have converged."""
+        return np.array([r is not None for r in self.results])
+
+    def update(self, t, states, members=None):
+        """Feed the chunk ``states`` of shape ``(len(members), len(t), dim)``.
+
+        ``members`` are the indices of the fed trajectories (all by default).
+        Chunks must follow each other in time.
+        """
+        states = np.asarray(states, dtype=float)
+        if states.ndim == 2:
+            states = states[None]
+        members = np.arange(len(self.results)) if members is None else np.asarray(members)
+
+        # Monitor the previous chunk together with the current one so that
+        # cycles longer than one chunk are still seen.
+        window_t, window = np.asarray(t), states
+        if self._t_prev is not None:
+            overlap = 1 if self._t_prev[-1] == t[0] else 0
+            window_t = np.concatenate([self._t_prev, t[overlap:]])
+            window = np.concatenate([self._prev[members], states[:, overlap:]], axis=1)
+        if self._prev is None or self._prev.shape[1:] != states.shape[1:]:
+            self._prev = np.empty((len(self.results),) + states.shape[1:])
+        self._prev[members] = states
+        self._t_prev = np.asarray(t)
+
+        # Time first, so that per-member parameter arrays broadcast.
+        with np.errstate(invalid='ignore', over='ignore'):
+            f = np.swapaxes(self.rhs(t[0], np.swapaxes(states, 0, 1)), 0, 1)
+        if self.variables is not None:
+            f = f[..., self.variables]
+            window_selected = window[..., self.variables]
+        else:
+            window_selected = window
+        below = np.abs(f).max(axis=-1) < self.ftol          # (m, n_t)
+        for j, member in enumerate(members):
+            if self.results[member] is not None:
+                continue
+            self._check_fixed_point(member, t, below[j], states[j])
+            if self.results[member] is None:
+                self._check_cycle(member, window_t, window[j], window_selected[j])
+        instrument.count('convergence.chunks')
+        return self.done[members]
+
+    def _check_fixed_point(self, member, t, below, states):
+        if below.all():
+            if np.isnan(self._below_since[member]):
+                self._below_since[member] = t[0]
+        else:
+            last_above = np.nonzero(~below)[0][-1]
+            self._below_since[member] = t[last_above + 1] if last_above + 1 < len(t) else np.nan
+        since = self._below_since[member]
+        if not np.isnan(since) and t[-1] - since >= self.hold:
+            self.results[member] = ConvergenceResult(
+                'fixed_point', float(since), float(t[-1]), float('nan'),
+                np.zeros(states.shape[-1]), states[-1].copy())
+
+    def _check_cycle(self, member, t, states, selected):
+        x = states[:, self.index]
+        lo, hi = x.min(), x.max()
+        if not hi - lo > self.ftol:
+            return
+        s = x - 0.5 * (lo + hi)
+        k = np.nonzero((s[:-1] < 0) & (s[1:] >= 0))[0]
+        if len(k) < self.n_cycles + 1:
+            return
+        k = k[-(self.n_cycles + 1):]
+        frac = (s[k] / (s[k] - s[k + 1]))[:, None]
+        t_cross = t[k] + frac[:, 0] * (t[k + 1] - t[k])
+        y_cross = selected[k] + frac * (selected[k + 1] - selected[k])
+
+        periods = np.diff(t_cross)
+        span = selected.max(axis=0) - selected.min(axis=0)
+        if np.ptp(periods) > self.rtol * periods.mean():
+            return
+        if np.any(np.ptp(y_cross, axis=0) > self.rtol * np.maximum(span, self.ftol)):
+            return
+        last = (t >= t_cross[-2]) & (t <= t_cross[-1])
+        amplitude = 0.5 * np.ptp(states[last], axis=0)
+        state = states[k[-1]] + frac[-1] * (states[k[-1] + 1] - states[k[-1]])
+        self.results[member] = ConvergenceResult(
+            'limit_cycle', float(t_cross[0]), float(t[-1]), float(periods.mean()),
+            amplitude, state)
+
+    def finish(self, t_stop, states):
+        """Mark all members that have not converged as ``'none'``."""
+        for member, result in enumerate(self.results):
+            if result is None:
+                self.results[member] = ConvergenceResult(
+                    'none', float('nan'), float(t_stop), float('nan'),
+                    np.full(states.shape[-1], np.nan), np.asarray(states[member]).copy())
+        return self.results
+
+
+def _subset(model, members, batched):
+    """Copy of ``model`` with the parameters ``batched`` restricted to ``members``."""
+    model = copy.copy(model)
+    for name in batched:
+        setattr(model, name, np.asarray(getattr(model, name))[members])
+    return model
+
+
+def integrate_until_converged(model, y0, t_max, dt=0.05, chunk_time=50.0,
+                              method='dopri5', batched=(), **monitor_options):
+    """Integrate the batch ``y0`` until every member converges or ``t_max``.
+
+    ``model.rhs`` is integrated with the NumPy integrators in chunks of
+    ``chunk_time`` sampled every ``dt``; converged members are removed from
+    the batch, together with their entries of the parameters named in
+    ``batched``, which must hold one value per member. Returns a list of
+    :class:`ConvergenceResult`, one per member.
+    """
+    y = np.atleast_2d(np.array(y0, dtype=float))
+    n = len(y)
+    for name in batched:
+        if np.shape(getattr(model, name)) != (n,):
+            raise ValueError(f"batched parameter {name!r} must have the shape ({n},)")
+    monitor = ConvergenceMonitor(model.rhs, n, **monitor_options)
+    members = np.arange(n)
+    active_model = model
+    n_chunk = max(2, int(round(chunk_time / dt)) + 1)
+    t0 = 0.0
+    while len(members) and t0 < t_max:
+        t1 = min(t0 + chunk_time, t_max)
+        t = np.linspace(t0, t1, n_chunk)
+        states = integrate(active_model.rhs, y[members], t, method=method)
+        y[members] = states[:, -1]
+        done = monitor.update(t, states, members)
+        if done.any():
+            active_model = _subset(active_model, ~done, batched)
+            monitor.rhs = active_model.rhs
+            members = members[~done]
+        t0 = t1
+    return monitor.finish(t0, y)
+
+
+def stream_until_converged(rhs, chunks, **monitor_options):
+    """Consume ``(t, solution)`` chunks of one trajectory until it converges.
+
+    Returns the :class:`ConvergenceResult`; the rest of the stream is never
+    computed.
+    """
+    monitor = ConvergenceMonitor(rhs, 1, **monitor_options)
+    t = solution = None
+    for t, solution in chunks:
+        if monitor.update(t, solution)[0]:
+            break
+    if t is None:
+        raise ValueError("empty chunk stream")
+    return monitor.finish(t[-1], solution[-1:])[0]
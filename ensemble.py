@@ -0,0 +1,182 @@
+"""Parallel execution of independent runs of one model.
+
+Every model exposes a single-trajectory solver ``solve(initial_state, t_end,
+n_points) -> (t, solution)`` (for the grid models this is ``_solve_one``).
+:func:`run_ensemble` maps such a solver over many initial states, either in
+process or on a :class:`~concurrent.futures.ProcessPoolExecutor`. Runs are
+sent to the workers in contiguous chunks so that every worker compiles the
+model once (see :mod:`model_cache`) and reuses it for the rest of its chunk.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+import instrument
+from integrators import integrate
+from streaming import iter_numpy
+
+
+class EnsembleResult:
+    """Runs of one model on a shared time grid.
+
+    The time grid ``t`` is stored once and the states of all runs in one
+    contiguous ``(n_runs, n_points, dim)`` array, optionally as float32.
+    Indexing and iteration give zero-copy views of single runs, so a result
+    can be passed wherever a list of solutions was used, while ``states``
+    allows vectorized analysis across runs. ``initial_states`` and
+    ``params`` record what was run.
+    """
+
+    def __init__(self, t, states, initial_states=None, params=None, dtype=None):
+        self.t = np.asarray(t)
+        self.states = np.ascontiguousarray(states, dtype=dtype)
+        if self.states.ndim != 3 or self.states.shape[1] != len(self.t):
+            raise ValueError("states must have the shape (n_runs, len(t), dim)")
+        self.initial_states = (None if initial_states is None
+                               else np.asarray(initial_states, dtype=float))
+        self.params = dict(params or {})
+
+    @property
+    def n_runs(self):
+        return self.states.shape[0]
+
+    @property
+    def n_points(self):
+        return self.states.shape[1]
+
+    @property
+    def dim(self):
+        return self.states.shape[2]
+
+    @property
+    def nbytes(self):
+        return self.t.nbytes + self.states.nbytes
+
+    def __len__(self):
+        return self.n_runs
+
+    def __getitem__(self, index):
+        """States of run ``index`` (a view), or a sub-ensemble for a slice or mask."""
+        if isinstance(index, (int, np.integer)):
+            return self.states[index]
+        initial = None if self.initial_states is None else self.initial_states[index]
+        return EnsembleResult(self.t, self.states[index], initial, self.params)
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.states if dtype is None else self.states.astype(dtype)
+
+    def __repr__(self):
+        return (f"EnsembleResult(n_runs={self.n_runs}, n_points={self.n_points}, "
+                f"dim={self.dim}, dtype={self.states.dtype})")
+
+    def run(self, index):
+        """``(t, solution)`` of one run, as returned by single-run solvers."""
+        return self.t, self.states[index]
+
+
+def integrate_batch(rhs, y0, t_end, n_points, method='dopri5', dtype=None,
+                    chunk_points=10000):
+    """Integrate the batch ``y0`` ``(n_runs, dim)`` with the NumPy integrators.
+
+    Returns ``(t, states)`` with ``states`` of shape ``(n_runs, n_points,
+    dim)``. With a ``dtype`` other than float64 the trajectories are
+    integrated in chunks of ``chunk_points`` (see :mod:`streaming`) and cast
+    into a preallocated array, so a float64 copy of the whole batch never
+    exists.
+    """
+    t = np.linspace(0, t_end, n_points)
+    y0 = np.asarray(y0, dtype=float)
+    if dtype is None or np.dtype(dtype) == np.float64:
+        return t, integrate(rhs, y0, t, method=method)
+    states = np.empty(y0.shape[:-1] + (n_points, y0.shape[-1]), dtype=dtype)
+    pos = 0
+    for t_chunk, chunk in iter_numpy(rhs, y0, t_end, n_points, chunk_points, method):
+        states[..., pos:pos + len(t_chunk), :] = chunk
+        pos += len(t_chunk)
+    return t, states
+
+
+def _solve_chunk(solve, initial_states, solve_kwargs):
+    t = None
+    solutions = []
+    for state in initial_states:
+        with instrument.stage('run'):
+            t, solution = solve(state, **solve_kwargs)
+        solutions.append(solution)
+    instrument.count('ensemble.runs', len(solutions))
+    return t, np.stack(solutions)
+
+
+def _solve_chunk_recorded(solve, initial_states, solve_kwargs):
+    """:func:`_solve_chunk` in a worker, returning its instrumentation too."""
+    with instrument.Recorder() as recorder:
+        t, chunk = _solve_chunk(solve, initial_states, solve_kwargs)
+    return t, chunk, recorder.state()
+
+
+def _store(states, n_runs, lo, hi, chunk, dtype=None):
+    if states is None:
+        states = np.empty((n_runs,) + chunk.shape[1:], dtype=dtype or chunk.dtype)
+    states[lo:hi] = chunk
+    return states
+
+
+def run_ensemble(solve, initial_states, workers=None, chunksize=None,
+                 progress=True, dtype=None, **solve_kwargs):
+    """Run ``solve(state, **solve_kwargs)`` for every initial state.
+
+    ``workers`` of ``None`` or ``1`` runs serially in this process, larger
+    values use a process pool of that size. Results are returned in the order
+    of ``initial_states`` as ``(t, states)`` where ``states`` has the shape
+    ``(n_runs, n_points, dim)`` and ``t`` is the shared time grid. With
+    ``dtype`` (e.g. ``np.float32``) the states are stored in that type.
+    """
+    initial_states = [tuple(state) for state in initial_states]
+    n_runs = len(initial_states)
+    if n_runs == 0:
+        raise ValueError("initial_states must not be empty")
+
+    workers = 1 if workers is None else int(workers)
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if chunksize is None:
+        chunksize = max(1, math.ceil(n_runs / (workers * 4)))
+    bounds = [(i, min(i + chunksize, n_runs)) for i in range(0, n_runs, chunksize)]
+
+    t = None
+    states = None
+    with tqdm(total=n_runs, disable=not progress) as bar:
+        if workers == 1:
+            for lo, hi in bounds:
+                t, chunk = _solve_chunk(solve, initial_states[lo:hi], solve_kwargs)
+                with instrument.stage('copy'):
+                    states = _store(states, n_runs, lo, hi, chunk, dtype)
+                bar.update(hi - lo)
+        else:
+            # Workers have no recorder of their own; when one is active here
+            # they record into a fresh one and their statistics are merged.
+            recorded = instrument.enabled()
+            task = _solve_chunk_recorded if recorded else _solve_chunk
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(task, solve, initial_states[lo:hi], solve_kwargs): (lo, hi)
+                    for lo, hi in bounds
+                }
+                for future in as_completed(futures):
+                    lo, hi = futures[future]
+                    if recorded:
+                        t, chunk, state = future.result()
+                        instrument.merge(state)
+                    else:
+                        t, chunk = future.result()
+                    with instrument.stage('copy'):
+                        states = _store(states, n_runs, lo, hi, chunk, dtype)
+                    bar.update(hi - lo)
+    instrument.record_array('ensemble', states)
+    return t, states
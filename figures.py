@@ -0,0 +1,80 @@
+"""Headless figure export.
+
+Every ``plot_*`` method of the models accepts ``show=False`` and returns its
+figure instead of opening a window. :func:`export_figures` uses that to render
+a list of independent figures with the non-interactive Agg backend, spread
+over a process pool, and writes one file per requested format together with a
+JSON manifest of everything that was produced.
+"""
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FORMATS = ('png', 'svg', 'pdf')
+
+FigureJob = namedtuple('FigureJob', ['name', 'target', 'method', 'args', 'kwargs'],
+                       defaults=((), {}))
+FigureJob.__doc__ = """One figure: ``getattr(target, method)(*args, show=False, **kwargs)``.
+
+``target`` is a model instance (it is pickled to the worker together with
+``args``), ``name`` is the file name without extension.
+"""
+
+
+def _use_agg():
+    import matplotlib
+
+    matplotlib.use('Agg', force=True)
+
+
+def _render(job, out_dir, formats, dpi):
+    _use_agg()
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    fig = getattr(job.target, job.method)(*job.args, show=False, **job.kwargs)
+    files = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f'{job.name}.{fmt}')
+        fig.savefig(path, format=fmt, dpi=dpi)
+        files.append({'path': os.path.basename(path), 'format': fmt,
+                      'bytes': os.path.getsize(path)})
+    plt.close(fig)
+    return {'name': job.name, 'method': job.method, 'files': files,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def export_figures(jobs, out_dir, formats=('png',), workers=None, dpi=150,
+                   manifest='manifest.json'):
+    """Render ``jobs`` into ``out_dir`` and return the manifest entries.
+
+    With ``workers`` greater than one the figures are rendered in parallel
+    processes. The manifest is written to ``out_dir/manifest`` unless
+    ``manifest`` is ``None``.
+    """
+    formats = tuple(formats)
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"unsupported formats {sorted(unknown)}, choose from {FORMATS}")
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("figure names must be unique")
+    os.makedirs(out_dir, exist_ok=True)
+
+    if workers is None or workers == 1:
+        entries = [_render(job, out_dir, formats, dpi) for job in jobs]
+    else:
+        entries = [None] * len(jobs)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+            futures = {pool.submit(_render, job, out_dir, formats, dpi): i
+                       for i, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                entries[futures[future]] = future.result()
+
+    if manifest is not None:
+        with open(os.path.join(out_dir, manifest), 'w') as f:
+            json.dump({'formats': list(formats), 'dpi': dpi, 'figures': entries},
+                      f, indent=2)
+    return entries
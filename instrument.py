@@ -0,0 +1,190 @@
+"""Per-stage timing and profiling of the solve path.
+
+The model classes, :mod:`model_cache`, :mod:`integrators` and
+:mod:`ensemble` report what they do through three hooks:
+
+* ``with stage(name):`` times a stage (``antimony`` parsing, SBML/LLVM
+  ``compile``, ``reset``, ``integrate``, ``copy``, ``plot``, ...). Stages nest,
+  and timings are keyed by their path, e.g. ``solve/compile``.
+* ``count(name, n)`` adds to a counter (integrator steps, rejected steps,
+  runs).
+* ``record_array(name, array)`` adds the bytes of an allocated result.
+
+Nothing is recorded unless a :class:`Recorder` is active::
+
+    with Recorder() as rec:
+        model.solve(...)
+    print(rec.report())
+
+Without an active recorder every hook returns immediately, so the hooks cost
+a single list check. Ensemble runs on a process pool record in the workers
+and merge their statistics into the active recorder of the parent.
+"""
+import contextlib
+import functools
+import io
+import time
+from collections import defaultdict
+
+_recorders = []
+_NULL = contextlib.nullcontext()
+
+
+def enabled():
+    """True if a :class:`Recorder` is active in this process."""
+    return bool(_recorders)
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.recorder._path.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        rec = self.recorder
+        rec.stages['/'.join(rec._path)].append(elapsed)
+        rec._path.pop()
+        return False
+
+
+def stage(name):
+    """Context manager timing the stage ``name`` in the active recorder."""
+    if not _recorders:
+        return _NULL
+    return _Stage(_recorders[-1], name)
+
+
+def timed(name):
+    """Decorator running the whole function as the stage ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _recorders:
+                return func(*args, **kwargs)
+            with _Stage(_recorders[-1], name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name``."""
+    if _recorders:
+        _recorders[-1].counters[name] += n
+
+
+def record_array(name, array):
+    """Add the size of ``array`` in bytes to ``name``."""
+    if _recorders:
+        _recorders[-1].array_bytes[name] += int(getattr(array, 'nbytes', 0))
+
+
+def merge(state):
+    """Merge a :meth:`Recorder.state` from another process into the active recorder."""
+    if _recorders:
+        _recorders[-1].merge(state)
+
+
+class Recorder:
+    """Collects stage timings, counters and array sizes while active.
+
+    With ``profile=True`` a cProfile profile of the whole block is kept in
+    :attr:`profile` (a ``pstats.Stats``); with ``trace_memory=True``
+    tracemalloc runs during the block and :attr:`memory_peak` holds the peak
+    traced size in bytes and :attr:`memory_top` the largest allocation sites.
+    """
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.stages = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.array_bytes = defaultdict(int)
+        self.profile = None
+        self.memory_peak = None
+        self.memory_top = None
+        self._path = []
+        self._profile = profile
+        self._trace_memory = trace_memory
+        self._profiler = None
+
+    def __enter__(self):
+        if self._trace_memory:
+            import tracemalloc
+
+            tracemalloc.start()
+        if self._profile:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        _recorders.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _recorders.remove(self)
+        if self._profiler is not None:
+            import pstats
+
+            self._profiler.disable()
+            self.profile = pstats.Stats(self._profiler, stream=io.StringIO())
+            self._profiler = None
+        if self._trace_memory:
+            import tracemalloc
+
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            self.memory_top = snapshot.statistics('lineno')[:10]
+            tracemalloc.stop()
+        return False
+
+    def state(self):
+        """Plain-data copy of the statistics, e.g. to send between processes."""
+        return {'stages': {k: list(v) for k, v in self.stages.items()},
+                'counters': dict(self.counters),
+                'array_bytes': dict(self.array_bytes)}
+
+    def merge(self, state, prefix=None):
+        """Add the statistics of another recorder's :meth:`state`.
+
+        Stage paths are put below ``prefix`` (by default the stage that is
+        currently open in this recorder).
+        """
+        if prefix is None:
+            prefix = '/'.join(self._path)
+        for name, times in state['stages'].items():
+            self.stages[f'{prefix}/{name}' if prefix else name].extend(times)
+        for name, n in state['counters'].items():
+            self.counters[name] += n
+        for name, n in state['array_bytes'].items():
+            self.array_bytes[name] += n
+
+    def summary(self):
+        """Per-stage ``calls``, ``total``, ``mean`` and ``max`` in seconds."""
+        return {name: {'calls': len(times), 'total': sum(times),
+                       'mean': sum(times) / len(times), 'max': max(times)}
+                for name, times in self.stages.items()}
+
+    def report(self, profile_lines=15):
+        """Human-readable table of all statistics."""
+        lines = [f"{'stage':40s} {'calls':>6s} {'total s':>10s} {'mean ms':>10s} {'max ms':>10s}"]
+        for name, s in sorted(self.summary().items()):
+            lines.append(f"{name:40s} {s['calls']:6d} {s['total']:10.4f} "
+                         f"{1e3 * s['mean']:10.3f} {1e3 * s['max']:10.3f}")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"{name:40s} {n:>17d}")
+        for name, n in sorted(self.array_bytes.items()):
+            lines.append(f"{name:40s} {n / 1024**2:14.2f} MiB")
+        if self.memory_peak is not None:
+            lines.append(f"{'tracemalloc peak':40s} {self.memory_peak / 1024**2:14.2f} MiB")
+        if self.profile is not None:
+            self.profile.stream = io.StringIO()
+            self.profile.sort_stats('cumulative').print_stats(profile_lines)
+            lines.append(self.profile.stream.getvalue())
+        return '\n'.join(lines)
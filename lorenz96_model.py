@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import warnings
+
 import numpy as np
-import tellurium as te
-import matplotlib.pyplot as plt
+
+import instrument
+import model_cache
+from integrators import check_backend, solver_settings
+from poincare import poincare_section
+
+# Above this many variables Lorenz96.solve() uses the native NumPy engine
+# instead of compiling the Antimony model.
+NATIVE_THRESHOLD = 64
 
 
 def build_antimony(N: int, F: float, x0: np.ndarray) -> str:
@@ -10,7 +19,7 @@ def build_antimony(N: int, F: float, x0: np.ndarray) -> str:
         x0 = F * np.ones(N)
 
     species_decl = ", ".join(f"x{i}={float(x0[i-1])}" for i in range(1, N + 1))
-    ant = f"model Lorenz96\n  // species and initial values\n  species {species_decl}\n  const F = {float(F)}\n\n"
+    lines = [f"model Lorenz96\n  // species and initial values\n  species {species_decl}\n  const F = {float(F)}\n"]
 
     for i in range(1, N + 1):
         ip1 = (i % N) + 1  # i+1
@@ -18,10 +27,91 @@ def build_antimony(N: int, F: float, x0: np.ndarray) -> str:
         im2 = (i - 3) % N + 1  # i-2
         # Lorenz-96: dx_i/dt = (x_{i+1} - x_{i-2}) * x_{i-1} - x_i + F
         expr = f"(x{ip1} - x{im2}) * x{im1} - x{i} + F"
-        ant += f"  x{i}' = {expr}\n"
+        lines.append(f"  x{i}' = {expr}")
+
+    lines.append("end")
+    return "\n".join(lines)
+
+
+def lorenz96_rhs(x: np.ndarray, F, out: np.ndarray | None = None) -> np.ndarray:
+    """Lorenz-96 tendencies along the last axis of ``x``.
+
+    Equivalent to ``(np.roll(x, -1) - np.roll(x, 2)) * np.roll(x, 1) - x + F``
+    but computed on slices, writing into ``out`` without temporaries for the
+    bulk of the array. ``x`` may hold a batch of states, shape ``(..., N)``,
+    and ``F`` a forcing per member, shape ``x.shape[:-1]``.
+    """
+    if out is None:
+        out = np.empty_like(x)
+    F = np.asarray(F)
+    body = out[..., 2:-1]
+    np.subtract(x[..., 3:], x[..., :-3], out=body)
+    body *= x[..., 1:-2]
+    body -= x[..., 2:-1]
+    body += F[..., None] if F.ndim else F
+    # the three periodic boundary points
+    out[..., 0] = (x[..., 1] - x[..., -2]) * x[..., -1] - x[..., 0] + F
+    out[..., 1] = (x[..., 2] - x[..., -1]) * x[..., 0] - x[..., 1] + F
+    out[..., -1] = (x[..., 0] - x[..., -3]) * x[..., -2] - x[..., -1] + F
+    return out
+
+
+def lorenz96_jvp(x: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """Jacobian of the Lorenz-96 tendencies at ``x`` applied to ``v``.
+
+    ``(J v)_i = (v_{i+1} - v_{i-2}) x_{i-1} + (x_{i+1} - x_{i-2}) v_{i-1} - v_i``;
+    ``v`` may carry extra leading axes (e.g. several tangent vectors).
+    """
+    x_m1 = np.roll(x, 1, axis=-1)
+    dx = np.roll(x, -1, axis=-1) - np.roll(x, 2, axis=-1)
+    dv = np.roll(v, -1, axis=-1) - np.roll(v, 2, axis=-1)
+    return dv * x_m1 + dx * np.roll(v, 1, axis=-1) - v
+
+
+class Lorenz96Engine:
+    """Allocation-free RK4 integrator for Lorenz-96.
+
+    All stage buffers are allocated once for a state of the given ``shape``
+    (``(N,)`` or ``(n_members, N)``) and reused in every step.
+    """
+
+    def __init__(self, shape, F: float, dt: float):
+        self.F = F
+        self.dt = float(dt)
+        self._k = [np.empty(shape) for _ in range(4)]
+        self._tmp = np.empty(shape)
 
-    ant += "end"
-    return ant
+    def step(self, x: np.ndarray) -> np.ndarray:
+        """Advance ``x`` by one step in place."""
+        k1, k2, k3, k4 = self._k
+        tmp, h, F = self._tmp, self.dt, self.F
+        lorenz96_rhs(x, F, out=k1)
+        np.multiply(k1, 0.5 * h, out=tmp)
+        tmp += x
+        lorenz96_rhs(tmp, F, out=k2)
+        np.multiply(k2, 0.5 * h, out=tmp)
+        tmp += x
+        lorenz96_rhs(tmp, F, out=k3)
+        np.multiply(k3, h, out=tmp)
+        tmp += x
+        lorenz96_rhs(tmp, F, out=k4)
+        k2 += k3
+        k2 *= 2.0
+        k1 += k2
+        k1 += k4
+        k1 *= h / 6.0
+        x += k1
+        return x
+
+    def integrate(self, x0: np.ndarray, n_steps: int, out: np.ndarray | None = None) -> np.ndarray:
+        """Take ``n_steps`` steps from ``x0`` and return all ``n_steps + 1`` states."""
+        x = np.array(x0, dtype=float)
+        if out is None:
+            out = np.empty((n_steps + 1,) + x.shape)
+        out[0] = x
+        for k in range(1, n_steps + 1):
+            out[k] = self.step(x)
+        return out
 
 
 class Lorenz96:
@@ -42,22 +132,104 @@ class Lorenz96:
             x0[0] += 0.01
         self.x0 = np.asarray(x0, dtype=float)
 
-        self._antimony = build_antimony(self.N, self.F, self.x0)
-        self.rr = None
+        self._antimony = None
+        self._rr = None
         self.result = None
         self.time = None
         self.states = None
 
-    def solve(self):
-        """Run the simulation and store the results on the instance."""
-        self.rr = te.loada(self._antimony)
-        self.result = self.rr.simulate(0, self.T, self.t_points)
+    @property
+    def rr(self):
+        """RoadRunner instance of the last Tellurium run, or ``None``.
+
+        Deprecated: the instance comes from ``model_cache`` and is shared by
+        every model with the same Antimony text, so a later simulation of
+        any of them changes its state.
+        """
+        warnings.warn("Lorenz96.rr is deprecated; use model_cache.load(model.antimony()) "
+                      "for a RoadRunner instance", DeprecationWarning, stacklevel=2)
+        return self._rr
+
+    def params(self) -> dict:
+        """Model parameters as a dict."""
+        return {'N': self.N, 'F': self.F}
+
+    def antimony(self) -> str:
+        """Antimony text of this model, built on first use."""
+        if self._antimony is None:
+            self._antimony = build_antimony(self.N, self.F, self.x0)
+        return self._antimony
+
+    def rhs(self, t, state):
+        """Right-hand side for the NumPy integrators, ``state`` is ``(..., N)``.
+
+        ``F`` may be an array with one forcing per member of the batch.
+        """
+        return lorenz96_rhs(state, self.F)
+
+    def jvp(self, state, v):
+        """Jacobian-vector product of :meth:`rhs`."""
+        return lorenz96_jvp(state, v)
+
+    @instrument.timed('solve')
+    def solve(self, backend: str | None = None, cache=None):
+        """Run the simulation and store the results on the instance.
+
+        ``backend`` is ``'tellurium'`` or ``'numpy'``; by default the native
+        NumPy engine is used for ``N >= NATIVE_THRESHOLD``. With a
+        ``ResultCache`` as ``cache`` a previously computed run is loaded
+        memory-mapped instead of integrated again; the result is then
+        read-only, whether it was loaded or just computed.
+        """
+        if backend is None:
+            backend = 'numpy' if self.N >= NATIVE_THRESHOLD else 'tellurium'
+        check_backend(backend)
+
+        if cache is not None:
+            # The NumPy backend runs Lorenz96Engine, not the Antimony model.
+            if backend == 'numpy':
+                model, solver = 'Lorenz96Engine', solver_settings(backend, 'rk4')
+            else:
+                model, solver = self.antimony(), solver_settings(backend)
+            key = cache.key(model=model, N=self.N, F=self.F, x0=self.x0,
+                            T=self.T, t_points=self.t_points, solver=solver)
+            self.result = cache.get(key)
+            if self.result is None:
+                cache.put(key, self.solve(backend))
+                self.result.flags.writeable = False
+                return self.result
+        elif backend == 'numpy':
+            time = np.linspace(0.0, self.T, self.t_points)
+            self.result = np.empty((self.t_points, self.N + 1))
+            self.result[:, 0] = time
+            engine = Lorenz96Engine(self.x0.shape, self.F, time[1] - time[0])
+            with instrument.stage('integrate'):
+                engine.integrate(self.x0, self.t_points - 1, out=self.result[:, 1:])
+            instrument.count('rk4.steps', self.t_points - 1)
+        else:
+            # The cached RoadRunner instance is shared; it is kept only for
+            # the deprecated rr attribute.
+            self._rr = model_cache.load(self.antimony())
+            with instrument.stage('integrate'):
+                self.result = self._rr.simulate(0, self.T, self.t_points)
+        instrument.record_array('integrate', self.result)
         self.time = self.result[:, 0]
         self.states = self.result[:, 1 : self.N + 1]
         return self.result
 
+    def poincare(self, section, transient: float = 0.0, **options):
+        """Crossings of ``section`` by the trajectory from ``x0`` over ``[0, T]``.
+
+        Crossings are located during integration, so memory scales with
+        their number rather than with ``t_points``. ``options`` are passed
+        to :func:`poincare.iter_crossings`.
+        """
+        return poincare_section(self.rhs, self.x0, self.T, section, transient, **options)
+
+    @instrument.timed('plot')
     def plot_3d(self, ax=None, show: bool = True):
         """3D visualization"""
+        import matplotlib.pyplot as plt
         if self.result is None:
             raise RuntimeError("Call solve() before plotting")
 
@@ -72,12 +244,16 @@ class Lorenz96:
         ax.set_ylabel("$Y$")
         ax.set_zlabel("$Z$")
         ax.set_title(f"Lorenz-96 model (N={self.N}, F={self.F})")
-        if show and created_fig:
+        if created_fig:
             plt.tight_layout()
-            plt.show()
+            if show:
+                plt.show()
+        return ax.figure
 
-    def plot_time_series(self, indices: list[int] | None = None):
+    @instrument.timed('plot')
+    def plot_time_series(self, indices: list[int] | None = None, show: bool = True):
         """Time series"""
+        import matplotlib.pyplot as plt
         if self.result is None:
             raise RuntimeError("Call solve() before plotting")
 
@@ -98,7 +274,9 @@ class Lorenz96:
         axes[-1].set_xlabel('Čas')
         
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 def main():
@@ -1,5 +1,22 @@
-import tellurium as te
-import matplotlib.pyplot as plt
+import numpy as np
+
+import instrument
+import model_cache
+from integrators import check_backend, integrate, solver_settings
+from poincare import poincare_section
+from streaming import iter_numpy, iter_tellurium, save_npy
+
+
+LORENZ_MODEL = '''
+model lorenz
+    x' = sigma * (y - x)
+    y' = x * (rho - z) - y
+    z' = x * y - beta * z
+
+    sigma = 10; rho = 28; beta = 2.6666666666666665
+    x = 1; y = 1; z = 1
+end
+'''
 
 
 class LorenzAttractor:
@@ -9,28 +26,95 @@ class LorenzAttractor:
         self.sigma = sigma
         self.rho = rho
         self.beta = beta
-    
-    def solve(self, initial_state=[1.0, 1.0, 1.0], t_end=50, n_points=5000):
-        """Reši sistem z Tellurium"""
+
+    def params(self):
+        """Parametri modela kot slovar"""
+        return {'sigma': self.sigma, 'rho': self.rho, 'beta': self.beta}
+
+    def rhs(self, t, state):
+        """Desna stran sistema za NumPy integratorje, state ima obliko (..., 3)"""
+        x, y, z = state[..., 0], state[..., 1], state[..., 2]
+        return np.stack([
+            self.sigma * (y - x),
+            x * (self.rho - z) - y,
+            x * y - self.beta * z,
+        ], axis=-1)
+
+    def jvp(self, state, v):
+        """Produkt Jacobijeve matrike v točki state z vektorji v (oblike (..., 3))"""
+        x, y, z = state[..., 0], state[..., 1], state[..., 2]
+        vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+        return np.stack([
+            self.sigma * (vy - vx),
+            (self.rho - z) * vx - vy - x * vz,
+            y * vx + x * vy - self.beta * vz,
+        ], axis=-1)
+
+    def _load_model(self, initial_state):
         x0, y0, z0 = initial_state
-        
-        model = te.loada(f'''
-            model lorenz
-                x' = {self.sigma} * (y - x)
-                y' = x * ({self.rho} - z) - y
-                z' = x * y - {self.beta} * z
-                
-                x = {x0}; y = {y0}; z = {z0}
-            end
-        ''')
-        
-        result = model.simulate(0, t_end, n_points)
+        return model_cache.load(LORENZ_MODEL, {
+            'sigma': self.sigma, 'rho': self.rho, 'beta': self.beta,
+            'x': x0, 'y': y0, 'z': z0,
+        })
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[1.0, 1.0, 1.0], t_end=50, n_points=5000,
+              backend='tellurium', method='dopri5', out=None, chunk_points=10000,
+              cache=None):
+        """Reši sistem z Tellurium ali z NumPy integratorjem
+
+        Z backend='numpy' je lahko initial_state paket oblike (n, 3),
+        rešitev pa ima potem obliko (n, n_points, 3). Če je podana pot out,
+        se trajektorija po kosih zapisuje v .npy datoteko (memmap). Z
+        cache (ResultCache) se že izračunane trajektorije preberejo z diska.
+        """
+        check_backend(backend)
+        if cache is not None and out is None:
+            key = cache.key(model=LORENZ_MODEL,
+                            params=[self.sigma, self.rho, self.beta],
+                            initial_state=initial_state, t_end=t_end,
+                            n_points=n_points, solver=solver_settings(backend, method))
+            return cache.cached(key, lambda: self.solve(initial_state, t_end, n_points,
+                                                        backend, method))
+        if out is not None:
+            chunks = self.solve_iter(initial_state, t_end, n_points, chunk_points, backend, method)
+            result = save_npy(out, chunks, n_points)
+            return result[..., 0], result[..., 1:]
+
+        if backend == 'numpy':
+            t = np.linspace(0, t_end, n_points)
+            return t, integrate(self.rhs, initial_state, t, method=method)
+
+        model = self._load_model(initial_state)
+        with instrument.stage('integrate'):
+            result = model.simulate(0, t_end, n_points)
+        instrument.record_array('integrate', result)
         t = result[:, 0]
         solution = result[:, 1:]
         return t, solution
     
-    def plot_3d(self, solution):
+    def solve_iter(self, initial_state=[1.0, 1.0, 1.0], t_end=50, n_points=5000,
+                   chunk_points=10000, backend='tellurium', method='dopri5'):
+        """Vrača trajektorijo po kosih (t, solution) z največ chunk_points vrsticami"""
+        check_backend(backend)
+        if backend == 'numpy':
+            return iter_numpy(self.rhs, initial_state, t_end, n_points, chunk_points, method)
+        return iter_tellurium(self._load_model(initial_state), t_end, n_points, chunk_points)
+
+    def poincare(self, section, initial_state=[1.0, 1.0, 1.0], t_end=500, transient=0.0,
+                 **options):
+        """Prečkanja Poincaréjevega preseka section (poincare.Section)
+
+        Prečkanja se poiščejo med integracijo, zato se trajektorija ne
+        shranjuje; initial_state je lahko paket oblike (n, 3). Vrne
+        poincare.Crossings, options se podajo poincare.iter_crossings.
+        """
+        return poincare_section(self.rhs, initial_state, t_end, section, transient, **options)
+
+    @instrument.timed('plot')
+    def plot_3d(self, solution, show=True):
         """3D vizualizacija"""
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111, projection='3d')
         ax.plot(solution[:, 0], solution[:, 1], solution[:, 2], 
@@ -40,10 +124,14 @@ class LorenzAttractor:
         ax.set_zlabel('Z')
         ax.set_title('Lorenzov atraktor')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_time_series(self, t, solution):
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, show=True):
         """Časovni potek"""
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(3, 1, figsize=(10, 6))
         labels = ['X', 'Y', 'Z']
         for i, (ax, label) in enumerate(zip(axes, labels)):
@@ -52,7 +140,9 @@ class LorenzAttractor:
             ax.grid(True, alpha=0.3)
         axes[-1].set_xlabel('Čas')
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 if __name__ == "__main__":
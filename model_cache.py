@@ -0,0 +1,84 @@
+"""Compile-once cache for Tellurium models.
+
+Parsing Antimony and JIT-compiling the resulting SBML dominates the cost of
+short simulations. Models are therefore compiled once per *structure* (the
+Antimony text without the concrete values of a run) and reused: each run
+resets the cached RoadRunner instance and sets initial values and parameters
+through setters.
+"""
+from collections import OrderedDict
+
+import instrument
+
+
+class ModelCache:
+    """LRU cache of compiled RoadRunner instances keyed by Antimony text."""
+
+    def __init__(self, maxsize=16):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = int(maxsize)
+        self._models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, antimony):
+        return antimony in self._models
+
+    def get(self, antimony):
+        """Return the compiled model for ``antimony``, compiling it on a miss."""
+        model = self._models.get(antimony)
+        if model is not None:
+            self._models.move_to_end(antimony)
+            self.hits += 1
+            return model
+
+        self.misses += 1
+        # Tellurium takes seconds to import, so it is only loaded on first use.
+        with instrument.stage('import'):
+            import tellurium as te
+
+        # Equivalent to te.loada(), split so that both stages can be timed.
+        with instrument.stage('antimony'):
+            sbml = te.antimonyToSBML(antimony)
+        with instrument.stage('compile'):
+            model = te.loadSBMLModel(sbml)
+        self._models[antimony] = model
+        if len(self._models) > self.maxsize:
+            self._models.popitem(last=False)
+        return model
+
+    def load(self, antimony, values=None):
+        """Return a freshly reset model with ``values`` applied.
+
+        ``values`` maps model symbols (species, rate-rule variables or
+        parameters) to the numbers used for this run.
+        """
+        model = self.get(antimony)
+        with instrument.stage('reset'):
+            model.resetToOrigin()
+            if values:
+                for name, value in values.items():
+                    model[name] = float(value)
+        return model
+
+    def clear(self):
+        self._models.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_default_cache = ModelCache()
+
+
+def get_cache():
+    """Process-wide cache used by the model classes."""
+    return _default_cache
+
+
+def load(antimony, values=None):
+    """Shortcut for ``get_cache().load(antimony, values)``."""
+    return _default_cache.load(antimony, values)
@@ -0,0 +1,180 @@
+"""Poincaré sections from event detection during integration.
+
+A batch of trajectories is integrated with adaptive Dormand-Prince steps
+(:func:`integrators.dopri5_step`). After every accepted step the section
+function ``g(y) = normal . y - offset`` is compared at both ends of the step;
+where it changes sign in the requested direction the crossing is located on
+the step's continuous extension (:func:`integrators.dopri5_dense`) with the
+Illinois variant of regula falsi, to the accuracy of the integrator rather
+than of an output grid. The stage derivatives of a step are dropped as soon
+as its crossings are found, so memory scales with the number of crossings
+and not with the length of the run.
+
+Steps are controlled by the local error only: a step that crosses the
+section twice (``g`` returns to its sign) is not detected, which for the
+tolerances used here means the section is nearly tangent to the flow.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+import instrument
+from integrators import dopri5_dense, dopri5_step
+
+Crossings = namedtuple('Crossings', ['member', 't', 'states'])
+Crossings.__doc__ = """Section crossings: batch member index, time and state per crossing."""
+
+
+class Section:
+    """The hyperplane ``normal . y = offset`` crossed in ``direction``.
+
+    ``direction=1`` counts crossings where ``normal . y - offset`` goes from
+    negative to non-negative, ``-1`` the opposite ones and ``0`` both.
+    """
+
+    def __init__(self, normal, offset=0.0, direction=1):
+        self.normal = np.asarray(normal, dtype=float)
+        self.offset = float(offset)
+        if direction not in (-1, 0, 1):
+            raise ValueError("direction must be -1, 0 or 1")
+        self.direction = direction
+
+    @classmethod
+    def plane(cls, index, level, dim, direction=1):
+        """The coordinate plane ``y[index] = level`` of a ``dim``-dimensional system."""
+        normal = np.zeros(dim)
+        normal[index] = 1.0
+        return cls(normal, level, direction)
+
+    def value(self, y):
+        """``g(y)``, vectorized over leading axes of ``y``."""
+        return y @ self.normal - self.offset
+
+    def crossed(self, g0, g1):
+        """Mask of steps from ``g0`` to ``g1`` that cross in ``direction``."""
+        up = (g0 < 0) & (g1 >= 0)
+        down = (g0 > 0) & (g1 <= 0)
+        if self.direction > 0:
+            return up
+        if self.direction < 0:
+            return down
+        return up | down
+
+
+def _locate(section, y, h, K, g0, g1, xtol, max_iter=50):
+    """Fractions ``theta`` of the steps at which ``g`` vanishes, and the states there."""
+    a, b = np.zeros(len(y)), np.ones(len(y))
+    ga, gb = g0.copy(), g1.copy()
+    side = np.zeros(len(y), dtype=int)
+    theta = a
+    for _ in range(max_iter):
+        theta = (a * gb - b * ga) / (gb - ga)
+        g = section.value(dopri5_dense(y, h, K, theta[:, None]))
+        if np.all((np.abs(g) <= xtol) | (b - a <= 1e-15)):
+            break
+        left = np.sign(g) == np.sign(ga)
+        # Illinois: halve the stale end's value when the same end moves twice.
+        gb = np.where(left & (side == 1), 0.5 * gb, gb)
+        ga = np.where(~left & (side == -1), 0.5 * ga, ga)
+        a, ga = np.where(left, theta, a), np.where(left, g, ga)
+        b, gb = np.where(left, b, theta), np.where(left, gb, g)
+        side = np.where(left, 1, -1)
+    return theta, dopri5_dense(y, h, K, theta[:, None])
+
+
+def iter_crossings(rhs, y0, t_end, section, transient=0.0, rtol=1e-8, atol=1e-10,
+                   h0=None, chunk=4096, xtol=1e-12, max_steps=10_000_000):
+    """Integrate ``y0`` to ``t_end`` and yield :class:`Crossings` in chunks.
+
+    ``y0`` has the shape ``(dim,)`` or ``(n, dim)``; crossings before
+    ``transient`` are skipped. Each yielded chunk holds about ``chunk``
+    crossings of all members, in the order they were found.
+    """
+    y = np.atleast_2d(np.array(y0, dtype=float))
+    n = len(y)
+    tc = np.zeros(n)
+    f = rhs(tc[:, None], y)
+    if h0 is None:
+        scale = atol + rtol * np.abs(y)
+        d0 = np.sqrt(np.mean((y / scale) ** 2, axis=-1))
+        d1 = np.sqrt(np.mean((f / scale) ** 2, axis=-1))
+        h = np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01 * d0 / np.maximum(d1, 1e-300))
+    else:
+        h = np.full(n, float(h0))
+    g = section.value(y)
+
+    found, n_found = [], 0
+    n_accepted = n_rejected = 0
+    for _ in range(max_steps):
+        active = tc < t_end
+        if not active.any():
+            break
+        last = h >= t_end - tc
+        h_step = np.where(active, np.where(last, t_end - tc, h), 0.0)
+        t_new = np.where(last, t_end, tc + h_step)
+        y_new, f_new, err, K = dopri5_step(rhs, tc[:, None], y, f, h_step[:, None])
+
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        with np.errstate(invalid='ignore', over='ignore'):
+            err_norm = np.sqrt(np.mean((err / scale) ** 2, axis=-1))
+        err_norm = np.where(np.isfinite(err_norm), err_norm, np.inf)
+        accept = active & (err_norm <= 1.0)
+        n_good = int(np.count_nonzero(accept))
+        n_accepted += n_good
+        n_rejected += int(np.count_nonzero(active)) - n_good
+
+        g_new = section.value(y_new)
+        hit = np.nonzero(accept & section.crossed(g, g_new))[0]
+        if len(hit):
+            theta, states = _locate(section, y[hit], h_step[hit, None], K[:, hit],
+                                    g[hit], g_new[hit], xtol)
+            t_hit = tc[hit] + theta * h_step[hit]
+            keep = t_hit >= transient
+            if keep.any():
+                found.append(Crossings(hit[keep], t_hit[keep], states[keep]))
+                n_found += int(keep.sum())
+        if n_found >= chunk:
+            yield _concatenate(found)
+            found, n_found = [], 0
+
+        y = np.where(accept[:, None], y_new, y)
+        f = np.where(accept[:, None], f_new, f)
+        g = np.where(accept, g_new, g)
+        tc = np.where(accept, t_new, tc)
+
+        with np.errstate(divide='ignore'):
+            factor = np.where(err_norm == 0.0, 10.0, 0.9 * err_norm ** -0.2)
+        factor = np.clip(factor, 0.2, 10.0)
+        factor = np.where(accept, factor, np.minimum(factor, 1.0))
+        h = np.where(active, h_step * factor, h)
+
+        # Members whose step underflows (divergence) are stopped.
+        failed = active & ~accept & (h <= 1e-14 * np.maximum(np.abs(tc), 1.0))
+        tc[failed] = t_end
+    else:
+        raise RuntimeError(f"did not reach t={t_end} in {max_steps} steps")
+
+    instrument.count('dopri5.steps', n_accepted)
+    instrument.count('dopri5.rejected', n_rejected)
+    if found:
+        yield _concatenate(found)
+
+
+def _concatenate(parts):
+    return Crossings(*(np.concatenate(field) for field in zip(*parts)))
+
+
+@instrument.timed('solve')
+def poincare_section(rhs, y0, t_end, section, transient=0.0, **options):
+    """All crossings of ``section`` as one :class:`Crossings`, sorted by member and time.
+
+    ``options`` are passed to :func:`iter_crossings`.
+    """
+    dim = np.shape(y0)[-1]
+    with instrument.stage('integrate'):
+        parts = list(iter_crossings(rhs, y0, t_end, section, transient, **options))
+    if not parts:
+        return Crossings(np.empty(0, dtype=int), np.empty(0), np.empty((0, dim)))
+    crossings = _concatenate(parts)
+    order = np.lexsort((crossings.t, crossings.member))
+    return Crossings(*(field[order] for field in crossings))
@@ -0,0 +1,288 @@
+"""Correlation dimension and recurrence quantification of long trajectories.
+
+Both analyses only need the pairs of points closer than a radius, which are
+found with a KD-tree (:class:`scipy.spatial.cKDTree`) instead of a full
+distance matrix, so memory stays linear in the trajectory length.
+
+* The correlation sum ``C(r)`` (Grassberger & Procaccia 1983) is the
+  fraction of point pairs closer than ``r``. Pairs within ``theiler``
+  samples of each other are left out, since neighbours along the trajectory
+  would otherwise inflate ``C`` at small ``r``. Optionally only a random
+  subset of ``n_reference`` points is paired with the whole trajectory.
+  Reference points are processed in blocks, each counted against the tree
+  for all radii at once with a dual-tree traversal (``count_neighbors``),
+  and the blocks are spread over a process pool. The correlation dimension
+  is the slope of ``log C`` against ``log r`` in the scaling region.
+* Recurrence quantification (Marwan et al. 2007) measures the diagonal and
+  vertical line structures of the recurrence matrix ``|x_i - x_j| <= radius``.
+  The matrix is never formed: neighbours are found one block of rows at a
+  time and diagonal lines crossing a block boundary are carried over. Long
+  trajectories are decimated in time to at most ``max_points`` samples.
+"""
+import math
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import instrument
+
+CorrelationSum = namedtuple('CorrelationSum', ['radii', 'C', 'pairs', 'n_reference', 'theiler'])
+CorrelationSum.__doc__ = """Correlation sum ``C`` at ``radii`` from ``pairs`` counted over ``n_reference`` points."""
+
+Dimension = namedtuple('Dimension', ['dimension', 'radii', 'C', 'slopes', 'fit_range'])
+Dimension.__doc__ = """Correlation dimension fitted over ``fit_range`` of radii.
+
+``slopes`` are the local slopes ``d log C / d log r``, which are flat in the
+scaling region.
+"""
+
+RQA = namedtuple('RQA', ['radius', 'n_points', 'step', 'RR', 'DET', 'L', 'L_max', 'ENTR',
+                         'LAM', 'TT', 'V_max'])
+RQA.__doc__ = """Recurrence quantification measures of ``n_points`` samples taken every ``step``.
+
+``RR`` recurrence rate, ``DET`` determinism, ``L`` mean and ``L_max``
+longest diagonal line, ``ENTR`` Shannon entropy of the diagonal line
+lengths, ``LAM`` laminarity, ``TT`` trapping time (mean vertical line) and
+``V_max`` longest vertical line.
+"""
+
+# Points and KD-tree of the trajectory, built once per worker process.
+_shared = {}
+
+
+def _init(points):
+    _shared['points'] = points
+    _shared['tree'] = cKDTree(points)
+
+
+def _count_block(reference, radii, theiler):
+    """Pairs closer than each radius and number of admissible pairs for a block of references."""
+    points, tree = _shared['points'], _shared['tree']
+    n = len(points)
+    ref = points[reference]
+    pairs = cKDTree(ref).count_neighbors(tree, radii).astype(np.int64)
+    # Remove the pairs within the Theiler window, each point with itself included.
+    close = np.zeros(len(radii) + 1, dtype=np.int64)
+    admissible = np.full(len(reference), n, dtype=np.int64)
+    for k in range(-theiler, theiler + 1):
+        j = reference + k
+        inside = (j >= 0) & (j < n)
+        admissible -= inside
+        d = np.linalg.norm(ref[inside] - points[j[inside]], axis=1)
+        close += np.bincount(np.searchsorted(radii, d), minlength=len(radii) + 1)
+    pairs -= np.cumsum(close)[:-1]
+    return pairs, int(admissible.sum())
+
+
+def default_radii(points, n=20):
+    """``n`` log-spaced radii from 0.1 % to 20 % of the largest extent of ``points``.
+
+    Counting time grows with the radius, so the range stops not far above
+    the scaling region.
+    """
+    extent = float(np.ptp(points, axis=0).max())
+    return np.geomspace(1e-3, 0.2, n) * extent
+
+
+@instrument.timed('solve')
+def correlation_sum(points, radii=None, theiler=10, n_reference=None, seed=0, workers=None,
+                    block_size=8192):
+    """Correlation sum of the trajectory ``points`` ``(n, dim)`` at ``radii``.
+
+    Pairs less than or equal to ``theiler`` samples apart are excluded. With
+    ``n_reference`` only that many randomly chosen points are paired with
+    the whole trajectory; ``workers > 1`` counts blocks of ``block_size``
+    references in parallel processes.
+    """
+    points = np.ascontiguousarray(points, dtype=float)
+    radii = np.sort(np.asarray(default_radii(points) if radii is None else radii, dtype=float))
+    n = len(points)
+    if n_reference is None or n_reference >= n:
+        reference = np.arange(n)
+    else:
+        rng = np.random.default_rng(seed)
+        reference = np.sort(rng.choice(n, size=n_reference, replace=False))
+    blocks = [reference[lo:lo + block_size] for lo in range(0, len(reference), block_size)]
+
+    pairs = np.zeros(len(radii), dtype=np.int64)
+    admissible = 0
+    if workers is None or workers == 1:
+        _init(points)
+        try:
+            for block in blocks:
+                counted, total = _count_block(block, radii, theiler)
+                pairs += counted
+                admissible += total
+        finally:
+            _shared.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                                 initargs=(points,)) as pool:
+            for counted, total in pool.map(_count_block, blocks, [radii] * len(blocks),
+                                           [theiler] * len(blocks)):
+                pairs += counted
+                admissible += total
+    instrument.count('recurrence.references', len(reference))
+    return CorrelationSum(radii, pairs / admissible, pairs, len(reference), theiler)
+
+
+def correlation_dimension(points, radii=None, fit_range=None, **options):
+    """Grassberger-Procaccia dimension of ``points``.
+
+    The slope of ``log C`` against ``log r`` is fitted over radii within
+    ``fit_range = (r_min, r_max)``, by default from 1 % to 10 % of the
+    largest extent of the points: below it too few pairs are counted, above
+    it the finite size of the attractor flattens ``C``. Check ``slopes`` for
+    a plateau before trusting the fit. ``options`` are passed to
+    :func:`correlation_sum`.
+    """
+    result = correlation_sum(points, radii, **options)
+    radii, C = result.radii, result.C
+    counted = C > 0
+    log_r, log_c = np.log(radii[counted]), np.log(C[counted])
+    slopes = np.full(len(radii), np.nan)
+    if counted.sum() > 1:
+        slopes[counted] = np.gradient(log_c, log_r)
+    if fit_range is None:
+        extent = float(np.ptp(points, axis=0).max())
+        fit_range = (0.01 * extent, 0.1 * extent)
+    fit = counted & (radii >= fit_range[0]) & (radii <= fit_range[1])
+    dimension = math.nan
+    if fit.sum() >= 2:
+        dimension = float(np.polyfit(np.log(radii[fit]), np.log(C[fit]), 1)[0])
+    return Dimension(dimension, radii, C, slopes, fit_range)
+
+
+def _runs(first, second):
+    """Start index and length of runs where ``first`` is constant and ``second`` steps by one.
+
+    The pairs must be sorted by ``first``, then ``second``.
+    """
+    if not len(first):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    brk = np.flatnonzero((np.diff(first) != 0) | (np.diff(second) != 1)) + 1
+    starts = np.concatenate([[0], brk])
+    lengths = np.diff(np.concatenate([starts, [len(first)]]))
+    return starts, lengths
+
+
+def _line_measures(histogram, minimum):
+    """Fraction of points on lines of at least ``minimum``, their mean and longest length, entropy."""
+    lengths = np.arange(len(histogram))
+    total = (lengths * histogram).sum()
+    lines = histogram[minimum:]
+    on_lines = (lengths[minimum:] * lines).sum()
+    longest = int(lengths[histogram > 0].max()) if histogram.any() else 0
+    if not lines.sum():
+        return 0.0, math.nan, longest, math.nan
+    p = lines[lines > 0] / lines.sum()
+    return (float(on_lines / total), float(on_lines / lines.sum()), longest,
+            float(-(p * np.log(p)).sum()))
+
+
+@instrument.timed('solve')
+def recurrence_quantification(points, radius=None, theiler=1, l_min=2, v_min=2,
+                              max_points=20000, block_size=2048):
+    """Recurrence quantification of the trajectory ``points`` ``(n, dim)``.
+
+    ``radius`` defaults to 5 % of the largest extent of the points. The
+    trajectory is decimated to at most ``max_points`` samples and the band
+    ``|i - j| <= theiler`` (in decimated samples) around the main diagonal is
+    excluded. Diagonal lines shorter than ``l_min`` and vertical lines
+    shorter than ``v_min`` do not count towards ``DET`` and ``LAM``.
+    """
+    points = np.asarray(points, dtype=float)
+    step = max(1, math.ceil(len(points) / max_points))
+    x = np.ascontiguousarray(points[::step])
+    n = len(x)
+    if radius is None:
+        radius = 0.05 * float(np.ptp(x, axis=0).max())
+    tree = cKDTree(x)
+
+    diagonal = np.zeros(n + 1, dtype=np.int64)   # histogram of diagonal line lengths
+    vertical = np.zeros(n + 1, dtype=np.int64)
+    carry = np.zeros(n, dtype=np.int64)          # open line length on each diagonal
+    n_recurrent = 0
+    for lo in range(0, n, block_size):
+        hi = min(lo + block_size, n)
+        found = cKDTree(x[lo:hi]).sparse_distance_matrix(tree, radius, output_type='ndarray')
+        i, j = found['i'].astype(np.int64) + lo, found['j'].astype(np.int64)
+        keep = np.abs(i - j) > theiler
+        i, j = i[keep], j[keep]
+
+        # Diagonal lines still open at the end of the previous block and not
+        # continued in this one are closed below.
+        ended = carry > 0
+        if len(i):
+            # Vertical lines lie within one row, which is always inside the block.
+            order = np.lexsort((j, i))
+            _, lengths = _runs(i[order], j[order])
+            vertical += np.bincount(lengths, minlength=n + 1)
+
+            # Diagonal lines of the upper triangle, continued across block boundaries.
+            upper = j > i
+            i, d = i[upper], j[upper] - i[upper]
+            n_recurrent += len(i)
+            order = np.lexsort((i, d))
+            i, d = i[order], d[order]
+            starts, lengths = _runs(d, i)
+            start_i, line = i[starts], d[starts]
+            # Lines that reach the last row of the block may continue in the next one.
+            open_ = start_i + lengths - 1 == hi - 1
+            continued = start_i == lo
+            lengths = lengths + np.where(continued, carry[line], 0)
+            ended[line[continued]] = False
+        diagonal += np.bincount(carry[ended], minlength=n + 1)
+        carry[:] = 0
+        if len(i):
+            carry[line[open_]] = lengths[open_]
+            diagonal += np.bincount(lengths[~open_], minlength=n + 1)
+    diagonal += np.bincount(carry[carry > 0], minlength=n + 1)
+    instrument.count('recurrence.pairs', n_recurrent)
+
+    admissible = (n - theiler - 1) * (n - theiler) / 2
+    DET, L, L_max, ENTR = _line_measures(diagonal, l_min)
+    LAM, TT, V_max, _ = _line_measures(vertical, v_min)
+    return RQA(float(radius), n, step, n_recurrent / admissible, DET, L, L_max, ENTR,
+               LAM, TT, V_max)
+
+
+@instrument.timed('plot')
+def plot_dimension(result, show=True):
+    """``log C`` against ``log r`` and the local slopes, with the fit range shaded."""
+    import matplotlib.pyplot as plt
+    fig, (ax_c, ax_s) = plt.subplots(2, 1, figsize=(8, 8), sharex=True)
+    ax_c.loglog(result.radii, result.C, 'o-')
+    ax_c.set_ylabel('C(r)')
+    ax_s.semilogx(result.radii, result.slopes, 'o-')
+    ax_s.axhline(result.dimension, color='tab:red', linestyle='--',
+                 label=f'D2 = {result.dimension:.3f}')
+    ax_s.set_ylabel('d log C / d log r')
+    ax_s.set_xlabel('r')
+    ax_s.legend()
+    for ax in (ax_c, ax_s):
+        ax.axvspan(*result.fit_range, color='tab:gray', alpha=0.2)
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+if __name__ == "__main__":
+    from aizawa import AizawaAttractor
+    from lorenz_attractor import LorenzAttractor
+    from thomas_attractor import ThomasAttractor
+
+    runs = {
+        'Lorenz': LorenzAttractor().solve(t_end=510, n_points=102001, backend='numpy'),
+        'Thomas': ThomasAttractor().solve(t_end=2100, n_points=105001, backend='numpy'),
+        'Aizawa': AizawaAttractor().solve(t_end=510, n_points=102001, backend='numpy').run(0),
+    }
+    for name, (t, solution) in runs.items():
+        points = solution[len(solution) // 50:]
+        result = correlation_dimension(points, theiler=100, n_reference=10000)
+        rqa = recurrence_quantification(points, max_points=10000)
+        print(f"{name}: D2 = {result.dimension:.3f}, RR = {rqa.RR:.4f}, DET = {rqa.DET:.3f}, "
+              f"L = {rqa.L:.2f}, LAM = {rqa.LAM:.3f}")
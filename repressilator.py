@@ -1,4 +1,22 @@
-import tellurium as te
+import numpy as np
+
+import instrument
+import model_cache
+from convergence import integrate_until_converged, stream_until_converged
+from integrators import check_backend, integrate, solver_settings
+from streaming import iter_tellurium
+
+
+REPRESSILATOR_MODEL = '''
+model repressilator
+    A' = alpha / (1 + C^n) - A
+    B' = alpha / (1 + A^n) - B
+    C' = alpha / (1 + B^n) - C
+
+    alpha = 1; n = 2
+    A = 0.1; B = 0.1; C = 0.1
+end
+'''
 
 
 class Repressilator:
@@ -6,26 +24,102 @@ class Repressilator:
     def __init__(self, alpha=1.0, n=2.0):
         self.alpha = alpha  # Stopnja transkripcije
         self.n = n          # Hillov koeficient
-    
-    def solve(self, initial_state=[0.1, 0.1, 0.1], t_end=100, n_points=5000):
-        """Reši sistem z Tellurium (Antimony)"""
+
+    def params(self):
+        """Parametri modela kot slovar"""
+        return {'alpha': self.alpha, 'n': self.n}
+
+    def rhs(self, t, state):
+        """Desna stran sistema za NumPy integratorje, state ima obliko (..., 3)"""
+        A, B, C = state[..., 0], state[..., 1], state[..., 2]
+        return np.stack([
+            self.alpha / (1 + C**self.n) - A,
+            self.alpha / (1 + A**self.n) - B,
+            self.alpha / (1 + B**self.n) - C,
+        ], axis=-1)
+
+    def jacobian(self, state):
+        """Jacobijeva matrika desne strani v stanju state (oblika (3,))"""
+        A, B, C = state
+        # d/dx alpha/(1 + x^n) = -alpha n x^(n-1) / (1 + x^n)^2
+        dA, dB, dC = (-self.alpha * self.n * x**(self.n - 1) / (1 + x**self.n)**2
+                      for x in (A, B, C))
+        return np.array([
+            [-1.0, 0.0, dC],
+            [dA, -1.0, 0.0],
+            [0.0, dB, -1.0],
+        ])
+
+    def dfdp(self, state, name):
+        """Odvod desne strani po parametru name ('alpha' ali 'n')"""
+        repressors = np.array([state[2], state[0], state[1]])
+        if name == 'alpha':
+            return 1 / (1 + repressors**self.n)
+        if name == 'n':
+            power = repressors**self.n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log = np.where(repressors > 0, np.log(repressors), 0.0)
+            return -self.alpha * power * log / (1 + power)**2
+        raise ValueError(f"neznan parameter {name!r}")
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[0.1, 0.1, 0.1], t_end=100, n_points=5000,
+              backend='tellurium', method='dopri5', cache=None):
+        """Reši sistem z Tellurium (Antimony) ali z NumPy integratorjem
+
+        Z backend='numpy' je lahko initial_state paket oblike (n, 3), alpha
+        in n pa polji oblike (n,) za hkratno reševanje več parametrov. Z
+        cache (ResultCache) se že izračunane trajektorije preberejo z diska.
+        """
+        check_backend(backend)
+        if cache is not None:
+            key = cache.key(model=REPRESSILATOR_MODEL, params=[self.alpha, self.n],
+                            initial_state=initial_state, t_end=t_end,
+                            n_points=n_points, solver=solver_settings(backend, method))
+            return cache.cached(key, lambda: self.solve(initial_state, t_end, n_points,
+                                                        backend, method))
+        if backend == 'numpy':
+            t = np.linspace(0, t_end, n_points)
+            return t, integrate(self.rhs, initial_state, t, method=method)
+
         A0, B0, C0 = initial_state
         
-        model = te.loada(f'''
-            model repressilator
-                A' = {self.alpha} / (1 + C^{self.n}) - A
-                B' = {self.alpha} / (1 + A^{self.n}) - B
-                C' = {self.alpha} / (1 + B^{self.n}) - C
-                
-                A = {A0}; B = {B0}; C = {C0}
-            end
-        ''')
+        model = model_cache.load(REPRESSILATOR_MODEL, {
+            'alpha': self.alpha, 'n': self.n, 'A': A0, 'B': B0, 'C': C0,
+        })
         
-        result = model.simulate(0, t_end, n_points)
+        with instrument.stage('integrate'):
+            result = model.simulate(0, t_end, n_points, ['time', 'A', 'B', 'C'])
+        instrument.record_array('integrate', result)
         t = result[:, 0]
         solution = result[:, 1:]
         return t, solution
 
+    @instrument.timed('solve')
+    def converge(self, initial_state=[0.1, 0.1, 0.1], t_max=1000, dt=0.05, chunk_time=50,
+                 backend='tellurium', method='dopri5', **options):
+        """Integrira le do ustalitve na limitni cikel ali fiksno točko
+
+        Vrne ConvergenceResult (perioda, amplituda, čas ustalitve); z
+        backend='numpy' in paketom začetnih stanj oblike (n, 3) seznam
+        rezultatov. options se podajo ConvergenceMonitor-ju.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            batched = [name for name, value in self.params().items() if np.ndim(value)]
+            results = integrate_until_converged(self, initial_state, t_max, dt, chunk_time,
+                                                method, batched, **options)
+            return results[0] if np.ndim(initial_state) == 1 else results
+
+        A0, B0, C0 = initial_state
+        model = model_cache.load(REPRESSILATOR_MODEL, {
+            'alpha': self.alpha, 'n': self.n, 'A': A0, 'B': B0, 'C': C0,
+        })
+        n_points = int(round(t_max / dt)) + 1
+        chunks = iter_tellurium(model, t_max, n_points, int(round(chunk_time / dt)),
+                                ['time', 'A', 'B', 'C'])
+        return stream_until_converged(self.rhs, chunks, **options)
+
 
 if __name__ == "__main__":
     print("Represilator - simulacija")
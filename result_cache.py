@@ -0,0 +1,113 @@
+"""Persistent, content-addressed cache of simulated trajectories.
+
+Results are stored as ``.npy`` files named by a SHA-256 hash of everything
+that determines them: model text, parameters, initial state, time grid and
+solver settings. A hit is loaded memory-mapped, so re-running an analysis or
+re-plotting costs a file open instead of a re-integration. The cache evicts
+the least recently used files once it grows beyond ``max_bytes``.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when a change to the solvers makes old entries invalid.
+CACHE_VERSION = 1
+
+DEFAULT_DIRECTORY = '.trajectory_cache'
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"cannot hash value of type {type(value).__name__}")
+
+
+class ResultCache:
+    """Directory of ``<hash>.npy`` trajectories with size-based LRU eviction."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        """Hash the keyword arguments into a stable hex digest."""
+        parts['cache_version'] = CACHE_VERSION
+        text = json.dumps(parts, sort_keys=True, default=_to_json)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """Return the stored array memory-mapped, or ``None`` on a miss."""
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)  # mark as recently used
+        return array
+
+    def put(self, key, array):
+        """Store ``array`` under ``key`` and evict old entries if needed."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def cached(self, key, solve):
+        """Return ``(t, solution)`` for ``key``, calling ``solve()`` on a miss.
+
+        The trajectory is stored RoadRunner-style with time in column 0, so a
+        hit returns views of one memory-mapped array. The views are read-only
+        on a miss too, so callers see the same kind of array either way.
+        """
+        result = self.get(key)
+        if result is None:
+            t, solution = solve()
+            solution = np.asarray(solution)
+            result = np.empty(solution.shape[:-1] + (solution.shape[-1] + 1,))
+            result[..., 0] = t
+            result[..., 1:] = solution
+            self.put(key, result)
+            result.flags.writeable = False
+        t = result[(0,) * (result.ndim - 2) + (slice(None), 0)]
+        return t, result[..., 1:]
+
+    def size(self):
+        """Total size of the stored trajectories in bytes."""
+        return sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                entries.append((path, os.stat(path)))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits ``max_bytes``."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= stat.st_size
+
+    def clear(self):
+        for path, _ in self._entries():
+            os.remove(path)
@@ -1,6 +1,22 @@
+import argparse
+
 from lorenz_attractor import LorenzAttractor
 from repressilator import Repressilator
 from lorenz96_model import Lorenz96
+from result_cache import ResultCache
+from figures import FORMATS, FigureJob, export_figures
+
+# Brez --export se grafi prikažejo interaktivno; z --export DIR se shranijo
+# v datoteke (Agg, brez oken), neodvisni grafi pa se rišejo vzporedno.
+parser = argparse.ArgumentParser(description="Vse analize atraktorjev")
+parser.add_argument('--export', metavar='DIR', help="shrani grafe v mapo DIR")
+parser.add_argument('--format', choices=FORMATS, nargs='+', default=['png'])
+parser.add_argument('--workers', type=int, default=None)
+args = parser.parse_args()
+
+# Trajectories are cached on disk; unchanged runs are loaded instead of re-integrated.
+cache = ResultCache()
+jobs = []
 
 print("=" * 70)
 print("MODELIRANJE ATRAKTORJEV Z NDE")
@@ -13,18 +29,22 @@ print("-" * 70)
 
 
 lorenz = LorenzAttractor(sigma=10.0, rho=28.0, beta=8.0/3.0)
-t, solution = lorenz.solve()
+t, solution = lorenz.solve(cache=cache)
 
-print("Vizualizacija...")
-lorenz.plot_3d(solution)
-lorenz.plot_time_series(t, solution)
+if args.export:
+    jobs += [FigureJob('lorenz_3d', lorenz, 'plot_3d', (solution,)),
+             FigureJob('lorenz_time_series', lorenz, 'plot_time_series', (t, solution))]
+else:
+    print("Vizualizacija...")
+    lorenz.plot_3d(solution)
+    lorenz.plot_time_series(t, solution)
 
 # 2. REPRESILATOR
 print("\n[2] REPRESILATOR")
 print("-" * 70)
 
 rep = Repressilator(alpha=20.0, n=2.0)
-t, solution = rep.solve(t_end=150)
+t, solution = rep.solve(t_end=150, cache=cache)
 
 print(f"Simulacija: {len(t)} točk, čas 0-150")
 print(f"Gen A: [{solution[:,0].min():.2f}, {solution[:,0].max():.2f}]")
@@ -33,11 +53,21 @@ print(f"Gen C: [{solution[:,2].min():.2f}, {solution[:,2].max():.2f}]")
 
 # 3. LORENZ96 MODEL
 lorenz96 = Lorenz96(N=5, F=8, T=30.0, dt=0.01)
-lorenz96.solve()
+lorenz96.solve(cache=cache)
 
 print("\n[3] LORENZ-96 MODEL")
 print("-" * 70)
-print("Vizualizacija...")
 
-lorenz96.plot_3d()
-lorenz96.plot_time_series()
\ No newline at end of file
+if args.export:
+    jobs += [FigureJob('lorenz96_3d', lorenz96, 'plot_3d'),
+             FigureJob('lorenz96_time_series', lorenz96, 'plot_time_series')]
+else:
+    print("Vizualizacija...")
+    lorenz96.plot_3d()
+    lorenz96.plot_time_series()
+
+if args.export:
+    print(f"\nIzvoz {len(jobs)} grafov v {args.export} ...")
+    for entry in export_figures(jobs, args.export, formats=args.format,
+                                workers=args.workers):
+        print(f"  {entry['name']}: {', '.join(f['path'] for f in entry['files'])}")
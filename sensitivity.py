@@ -0,0 +1,186 @@
+"""Global (variance-based) parameter sensitivity with Sobol indices.
+
+Parameters are drawn with Saltelli's scheme from a scrambled Sobol sequence
+(:mod:`scipy.stats.qmc`): two base matrices ``A`` and ``B`` of ``n`` points
+and, for every parameter ``i``, the matrix ``AB_i`` equal to ``A`` with
+column ``i`` taken from ``B`` - ``n * (k + 2)`` model evaluations for ``k``
+parameters.
+
+All evaluations are independent, so the samples are cut into blocks; every
+block is one NumPy batch (the model parameters are set to arrays, see
+:mod:`integrators`) and the blocks are spread over a process pool. Each
+trajectory is reduced to scalar outputs over the window after ``transient``:
+
+* ``'amplitude'`` - half the peak-to-peak range of ``state[variable]``,
+* ``'period'`` - the mean time between upward crossings of the mid-range
+  (NaN without at least two crossings, e.g. at a fixed point),
+* ``'mean'`` - the time average of ``state[variable]``.
+
+First-order indices use the estimator of Saltelli et al. (2010), total
+indices Jansen's; samples with a non-finite output in any of the matrices
+involved are left out of that index. Confidence intervals are percentiles
+over bootstrap resamples of the ``n`` base points.
+"""
+import copy
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.stats import qmc
+from tqdm import tqdm
+
+import instrument
+from streaming import iter_numpy
+
+OUTPUTS = ('amplitude', 'period', 'mean')
+
+SaltelliDesign = namedtuple('SaltelliDesign', ['names', 'A', 'B', 'AB'])
+SaltelliDesign.__doc__ = """Saltelli sample matrices: ``A`` and ``B`` are ``(n, k)``, ``AB`` is ``(k, n, k)``."""
+
+SobolResult = namedtuple('SobolResult', ['names', 'outputs', 'S1', 'ST', 'S1_ci', 'ST_ci',
+                                         'n_evaluations'])
+SobolResult.__doc__ = """Sobol indices per output and parameter.
+
+``S1`` and ``ST`` have the shape ``(n_outputs, k)``, the confidence
+intervals ``(n_outputs, k, 2)``.
+"""
+
+
+def saltelli_design(bounds, n=1024, seed=0):
+    """Saltelli matrices for ``bounds``, a dict ``{name: (low, high)}``.
+
+    ``n`` is rounded up to a power of two, which keeps the Sobol sequence
+    balanced.
+    """
+    names = list(bounds)
+    k = len(names)
+    m = int(np.ceil(np.log2(max(n, 2))))
+    unit = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random_base2(m)
+    low = np.array([bounds[name][0] for name in names], dtype=float)
+    high = np.array([bounds[name][1] for name in names], dtype=float)
+    A = qmc.scale(unit[:, :k], low, high)
+    B = qmc.scale(unit[:, k:], low, high)
+    AB = np.repeat(A[None], k, axis=0)
+    for i in range(k):
+        AB[i, :, i] = B[:, i]
+    return SaltelliDesign(names, A, B, AB)
+
+
+def trajectory_outputs(t, x):
+    """Amplitude, period and mean of the sampled series ``x`` ``(n, n_t)``."""
+    lo, hi = x.min(axis=1), x.max(axis=1)
+    s = x - 0.5 * (lo + hi)[:, None]
+    member, k = np.nonzero((s[:, :-1] < 0) & (s[:, 1:] >= 0))
+    frac = s[member, k] / (s[member, k] - s[member, k + 1])
+    t_cross = t[k] + frac * (t[k + 1] - t[k])
+    count = np.bincount(member, minlength=len(x))
+    # Mean period = (last crossing - first crossing) / (crossings - 1).
+    first = np.full(len(x), np.nan)
+    last = np.full(len(x), np.nan)
+    first[member[::-1]] = t_cross[::-1]
+    last[member] = t_cross
+    with np.errstate(invalid='ignore', divide='ignore'):
+        period = np.where(count >= 2, (last - first) / (count - 1), np.nan)
+    return np.column_stack([0.5 * (hi - lo), period, x.mean(axis=1)])
+
+
+def _evaluate_block(model, names, values, initial_state, transient, t_end, dt, variable,
+                    method, chunk_points):
+    model = copy.copy(model)
+    for name, column in zip(names, values.T):
+        setattr(model, name, column.copy())
+    n_points = int(round(t_end / dt)) + 1
+    y0 = np.broadcast_to(np.asarray(initial_state, dtype=float),
+                         (len(values), len(initial_state))).copy()
+    times, window = [], []
+    with instrument.stage('integrate'):
+        for t, chunk in iter_numpy(model.rhs, y0, t_end, n_points, chunk_points, method):
+            keep = t >= transient
+            times.append(t[keep])
+            window.append(chunk[:, keep, variable])
+    return trajectory_outputs(np.concatenate(times), np.concatenate(window, axis=1))
+
+
+def evaluate(model, names, samples, initial_state, transient=100.0, t_end=200.0, dt=0.05,
+             variable=0, method='rk4', workers=None, block_size=1024, chunk_points=2000,
+             progress=True):
+    """Outputs ``(n_samples, len(OUTPUTS))`` of ``model`` at the parameter rows ``samples``."""
+    samples = np.asarray(samples, dtype=float)
+    blocks = [(lo, samples[lo:lo + block_size]) for lo in range(0, len(samples), block_size)]
+    args = (initial_state, transient, t_end, dt, variable, method, chunk_points)
+    result = np.empty((len(samples), len(OUTPUTS)))
+    with tqdm(total=len(samples), disable=not progress) as bar:
+        if workers is None or workers == 1:
+            for lo, values in blocks:
+                result[lo:lo + len(values)] = _evaluate_block(model, names, values, *args)
+                bar.update(len(values))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_evaluate_block, model, names, values, *args):
+                           (lo, len(values)) for lo, values in blocks}
+                for future in as_completed(futures):
+                    lo, size = futures[future]
+                    result[lo:lo + size] = future.result()
+                    bar.update(size)
+    instrument.count('sensitivity.evaluations', len(samples))
+    return result
+
+
+def sobol_indices(fA, fB, fAB):
+    """First-order and total indices from outputs ``fA, fB`` ``(..., n)`` and ``fAB`` ``(k, ..., n)``.
+
+    Returns ``(S1, ST)`` of shape ``(..., k)``.
+    """
+    S1 = np.empty(fA.shape[:-1] + (len(fAB),))
+    ST = np.empty_like(S1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, fABi in enumerate(fAB):
+            valid = np.isfinite(fA) & np.isfinite(fB) & np.isfinite(fABi)
+            count = valid.sum(axis=-1)
+            a, b, ab = (np.where(valid, f, 0.0) for f in (fA, fB, fABi))
+            mean = (a + b).sum(axis=-1) / (2 * count)
+            variance = (((a - mean[..., None]) ** 2 + (b - mean[..., None]) ** 2)
+                        * valid).sum(axis=-1) / (2 * count - 1)
+            S1[..., i] = (b * (ab - a)).sum(axis=-1) / count / variance
+            ST[..., i] = 0.5 * ((a - ab) ** 2).sum(axis=-1) / count / variance
+    return S1, ST
+
+
+@instrument.timed('solve')
+def sobol_analysis(model, bounds, initial_state, n=1024, n_bootstrap=1000, confidence=0.95,
+                   seed=0, **options):
+    """Sobol indices of ``OUTPUTS`` with respect to the parameters in ``bounds``.
+
+    ``bounds`` maps attribute names of ``model`` to ``(low, high)``;
+    ``options`` are passed to :func:`evaluate`. ``n * (k + 2)`` trajectories
+    are integrated.
+    """
+    design = saltelli_design(bounds, n, seed)
+    k, n = len(design.names), len(design.A)
+    samples = np.concatenate([design.A, design.B, design.AB.reshape(-1, k)])
+    f = evaluate(model, design.names, samples, initial_state, **options).T   # (n_out, N)
+    fA, fB = f[:, :n], f[:, n:2 * n]
+    fAB = f[:, 2 * n:].reshape(len(OUTPUTS), k, n).swapaxes(0, 1)         # (k, n_out, n)
+    S1, ST = sobol_indices(fA, fB, fAB)
+
+    rng = np.random.default_rng(seed)
+    resample = rng.integers(0, n, size=(n_bootstrap, n))
+    S1_boot, ST_boot = sobol_indices(fA[:, resample], fB[:, resample], fAB[:, :, resample])
+    q = [0.5 * (1 - confidence), 0.5 * (1 + confidence)]
+    S1_ci = np.moveaxis(np.nanquantile(S1_boot, q, axis=1), 0, -1)
+    ST_ci = np.moveaxis(np.nanquantile(ST_boot, q, axis=1), 0, -1)
+    return SobolResult(design.names, OUTPUTS, S1, ST, S1_ci, ST_ci, len(samples))
+
+
+if __name__ == "__main__":
+    from repressilator import Repressilator
+
+    result = sobol_analysis(Repressilator(), {'alpha': (5.0, 50.0), 'n': (1.5, 4.0)},
+                            initial_state=[0.1, 0.2, 0.3], n=1024, workers=None)
+    print(f"{result.n_evaluations} evaluations")
+    for j, output in enumerate(result.outputs):
+        for i, name in enumerate(result.names):
+            print(f"{output:10s} {name:6s} S1 = {result.S1[j, i]:6.3f} "
+                  f"[{result.S1_ci[j, i, 0]:6.3f}, {result.S1_ci[j, i, 1]:6.3f}]  "
+                  f"ST = {result.ST[j, i]:6.3f} "
+                  f"[{result.ST_ci[j, i, 0]:6.3f}, {result.ST_ci[j, i, 1]:6.3f}]")
@@ -0,0 +1,250 @@
+"""Stochastic (Gillespie SSA) ensembles with streaming statistics.
+
+Realizations are simulated in blocks of ``block_size``; every block gets its
+own child of ``np.random.SeedSequence(seed)``, so the results depend only on
+``seed`` and ``block_size`` and not on the number of workers. Each block is
+sampled on the common output grid and immediately folded into
+
+* :class:`RunningMoments` - mean and variance per time point and species
+  (Welford's update, blocks combined with Chan's parallel formula), and
+* :class:`HistogramSketch` - a fixed-bin histogram per time point and
+  species from which quantiles are interpolated.
+
+Both are mergeable and have a size independent of the number of
+realizations, so memory stays constant no matter how many are run, and
+blocks can be spread over a process pool.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+import instrument
+
+StochasticSummary = namedtuple('StochasticSummary',
+                               ['t', 'n', 'mean', 'variance', 'quantiles'])
+StochasticSummary.__doc__ = """Statistics of a stochastic ensemble.
+
+``mean`` and ``variance`` have the shape ``(n_points, dim)``, ``quantiles``
+maps every requested quantile to an array of that shape.
+"""
+
+
+class RunningMoments:
+    """Mean and variance of samples of the given ``shape``, updated in batches."""
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def add(self, samples):
+        """Add a batch of samples, shape ``(n,) + shape``."""
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) == 0:
+            return
+        mean = samples.mean(axis=0)
+        self._combine(len(samples), mean, ((samples - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        """Add the samples summarized by another :class:`RunningMoments`."""
+        if other.count:
+            self._combine(other.count, other.mean, other._m2)
+
+    def _combine(self, n_b, mean_b, m2_b):
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * (n_b / n)
+        self._m2 = self._m2 + m2_b + delta ** 2 * (n_a * n_b / n)
+        self.count = n
+
+    @property
+    def variance(self):
+        """Unbiased sample variance (NaN for fewer than two samples)."""
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return self._m2 / (self.count - 1)
+
+
+class HistogramSketch:
+    """Per-cell histograms with ``bins`` bins on ``[lo, hi]`` for quantiles.
+
+    ``lo`` and ``hi`` broadcast against ``shape`` (e.g. one range per
+    species). Values outside the range are counted in the edge bins, so
+    quantiles in the far tails are only as good as the range.
+    """
+
+    def __init__(self, shape, lo, hi, bins=256):
+        self.shape = tuple(shape)
+        self.bins = int(bins)
+        self.lo = np.broadcast_to(np.asarray(lo, dtype=float), self.shape).copy()
+        self.hi = np.broadcast_to(np.asarray(hi, dtype=float), self.shape).copy()
+        if np.any(self.hi <= self.lo):
+            raise ValueError("hi must be greater than lo")
+        self.counts = np.zeros(self.shape + (self.bins,), dtype=np.int64)
+
+    def add(self, samples):
+        """Add a batch of samples, shape ``(n,) + shape``."""
+        samples = np.asarray(samples, dtype=float)
+        width = (self.hi - self.lo) / self.bins
+        index = np.floor((samples - self.lo) / width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        cells = np.arange(int(np.prod(self.shape))).reshape(self.shape) * self.bins
+        flat = (index + cells).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same bins."""
+        if (other.counts.shape != self.counts.shape or not np.array_equal(other.lo, self.lo)
+                or not np.array_equal(other.hi, self.hi)):
+            raise ValueError("sketches have different bins")
+        self.counts += other.counts
+
+    def quantile(self, q):
+        """Linearly interpolated quantile(s) ``q``, shape ``np.shape(q) + shape``."""
+        q = np.asarray(q, dtype=float)
+        cumulative = np.cumsum(self.counts, axis=-1)
+        total = cumulative[..., -1]
+        width = (self.hi - self.lo) / self.bins
+        result = np.empty(q.shape + self.shape)
+        for i, level in np.ndenumerate(q):
+            target = level * total
+            k = np.minimum((cumulative < target[..., None]).sum(axis=-1), self.bins - 1)
+            before = np.where(k > 0, np.take_along_axis(
+                cumulative, np.maximum(k - 1, 0)[..., None], axis=-1)[..., 0], 0)
+            inside = np.take_along_axis(self.counts, k[..., None], axis=-1)[..., 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                frac = np.where(inside > 0, (target - before) / inside, 0.5)
+            value = self.lo + (k + np.clip(frac, 0.0, 1.0)) * width
+            result[i] = np.where(total > 0, value, np.nan)
+        return result
+
+
+def gillespie(propensities, stoichiometry, x0, t, rng):
+    """Direct-method SSA for a batch of realizations, sampled on the grid ``t``.
+
+    ``propensities(x)`` maps counts ``(B, dim)`` to reaction propensities
+    ``(B, n_reactions)``; ``stoichiometry`` is ``(n_reactions, dim)``. All
+    realizations advance together, one reaction event each per iteration,
+    and the state at ``t[k]`` is the state after the last event before it.
+    Returns counts of shape ``(B, len(t), dim)``.
+    """
+    x = np.array(x0, dtype=float)
+    stoichiometry = np.asarray(stoichiometry, dtype=float)
+    t = np.asarray(t, dtype=float)
+    n_batch, n_out = len(x), len(t)
+    out = np.empty((n_batch, n_out, x.shape[-1]))
+    out[:, 0] = x
+    tc = np.full(n_batch, t[0])
+    next_out = np.ones(n_batch, dtype=int)
+
+    n_events = 0
+    active = np.arange(n_batch)
+    while len(active):
+        a = propensities(x[active])
+        a0 = a.sum(axis=-1)
+        with np.errstate(divide='ignore'):
+            t_new = tc[active] + rng.exponential(size=len(active)) / a0
+
+        # Record every grid time passed before the next event.
+        pending = t[np.minimum(next_out[active], n_out - 1)] < t_new
+        pending &= next_out[active] < n_out
+        while pending.any():
+            idx = active[pending]
+            out[idx, next_out[idx]] = x[idx]
+            next_out[idx] += 1
+            pending &= next_out[active] < n_out
+            pending &= t[np.minimum(next_out[active], n_out - 1)] < t_new
+
+        fire = np.isfinite(t_new)
+        u = rng.random(len(active)) * a0
+        reaction = np.minimum((np.cumsum(a, axis=-1) <= u[:, None]).sum(axis=-1),
+                              len(stoichiometry) - 1)
+        x[active[fire]] += stoichiometry[reaction[fire]]
+        tc[active] = t_new
+        n_events += int(fire.sum())
+        active = active[next_out[active] < n_out]
+
+    instrument.count('ssa.events', n_events)
+    return out
+
+
+def _summarize(t, samples, value_range, bins):
+    moments = RunningMoments(samples.shape[1:])
+    moments.add(samples)
+    sketch = HistogramSketch(samples.shape[1:], value_range[0], value_range[1], bins)
+    sketch.add(samples)
+    return t, moments, sketch
+
+
+def _block_statistics(simulate, n, seed, value_range, bins, simulate_kwargs):
+    t, samples = simulate(n, seed=seed, **simulate_kwargs)
+    return _summarize(t, samples, value_range, bins)
+
+
+def _default_range(samples):
+    """Histogram range per species from a first block: ``[min(0, lo), 2 hi]``."""
+    lo = np.minimum(samples.min(axis=(0, 1)), 0.0)
+    hi = np.maximum(2.0 * samples.max(axis=(0, 1)), lo + 1e-12)
+    return lo, hi
+
+
+def ensemble_statistics(simulate, n_realizations, seed=0, workers=None, block_size=256,
+                        bins=256, value_range=None, quantiles=(0.05, 0.5, 0.95),
+                        progress=True, **simulate_kwargs):
+    """Run ``n_realizations`` of ``simulate`` and return a :class:`StochasticSummary`.
+
+    ``simulate(n, seed=SeedSequence, **simulate_kwargs)`` returns ``(t,
+    samples)`` with samples of shape ``(n, n_points, dim)``. ``value_range``
+    is ``(lo, hi)`` for the quantile histograms, by default derived from the
+    first block.
+    """
+    if n_realizations < 1:
+        raise ValueError("n_realizations must be at least 1")
+    sizes = [min(block_size, n_realizations - lo)
+             for lo in range(0, n_realizations, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    moments = sketch = t = None
+    todo = list(range(len(sizes)))
+
+    def fold(result):
+        nonlocal t, moments, sketch
+        t, block_moments, block_sketch = result
+        if moments is None:
+            moments, sketch = block_moments, block_sketch
+        else:
+            moments.merge(block_moments)
+            sketch.merge(block_sketch)
+
+    with tqdm(total=n_realizations, disable=not progress) as bar:
+        if value_range is None:
+            # The first block fixes the histogram range for all others.
+            t, samples = simulate(sizes[0], seed=seeds[0], **simulate_kwargs)
+            value_range = _default_range(samples)
+            fold(_summarize(t, samples, value_range, bins))
+            del samples
+            bar.update(sizes[0])
+            todo = todo[1:]
+
+        args = [(simulate, sizes[i], seeds[i], value_range, bins, simulate_kwargs)
+                for i in todo]
+        workers = 1 if workers is None else int(workers)
+        if workers == 1:
+            for i, arg in zip(todo, args):
+                fold(_block_statistics(*arg))
+                bar.update(sizes[i])
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_block_statistics, *arg): i
+                           for i, arg in zip(todo, args)}
+                for future in as_completed(futures):
+                    fold(future.result())
+                    bar.update(sizes[futures[future]])
+
+    quantiles = tuple(quantiles)
+    values = sketch.quantile(quantiles) if quantiles else []
+    return StochasticSummary(t, moments.count, moments.mean, moments.variance,
+                             dict(zip(quantiles, values)))
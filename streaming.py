@@ -0,0 +1,107 @@
+"""Chunked integration for trajectories that should not live in RAM.
+
+A trajectory of ``n_points`` samples on ``[0, t_end]`` is integrated segment
+by segment; the state at the end of a segment is the starting point of the
+next one, so the concatenated chunks equal a single long run on the same
+output grid. Peak memory is bounded by ``chunk_points`` instead of
+``n_points``.
+
+A stream may also start at sample ``start > 0`` from the state at
+``t[start - 1]``; with ``start`` on a chunk boundary the chunks are exactly
+those of a stream from 0, which is how :mod:`checkpoint` resumes runs.
+"""
+import numpy as np
+from numpy.lib.format import open_memmap
+
+import instrument
+from integrators import integrate
+
+
+def chunk_bounds(n_points, chunk_points, start=0):
+    """Index ranges ``(lo, hi)`` of the output samples in each chunk from ``start``."""
+    if chunk_points < 2:
+        raise ValueError("chunk_points must be at least 2")
+    return [(lo, min(lo + chunk_points, n_points))
+            for lo in range(start, n_points, chunk_points)]
+
+
+def _model_values(model):
+    """Parameters and current state of a RoadRunner model, by id."""
+    ids = [*model.getGlobalParameterIds(), *model.getFloatingSpeciesIds(),
+           *model.getRateRuleIds()]
+    return {name: model[name] for name in dict.fromkeys(ids)}
+
+
+def iter_tellurium(model, t_end, n_points, chunk_points, selections=None, start=0):
+    """Stream ``(t, solution)`` chunks from a loaded RoadRunner model.
+
+    Every segment after the first starts at the last sample of the previous
+    one, which is dropped. With ``start > 0`` the model must hold the state
+    at ``t[start - 1]``. Instances from :mod:`model_cache` are shared, so the
+    parameters and state are taken when the stream is created and applied
+    again before every segment; other runs of the same model between two
+    chunks do not disturb the stream.
+    """
+    values = _model_values(model)
+    return _iter_tellurium(model, values, t_end, n_points, chunk_points, selections, start)
+
+
+def _iter_tellurium(model, values, t_end, n_points, chunk_points, selections, start):
+    t = np.linspace(0, t_end, n_points)
+    for lo, hi in chunk_bounds(n_points, chunk_points, start):
+        first = max(lo - 1, 0)
+        for name, value in values.items():
+            model[name] = value
+        with instrument.stage('integrate'):
+            if selections is None:
+                result = model.simulate(t[first], t[hi - 1], hi - first)
+            else:
+                result = model.simulate(t[first], t[hi - 1], hi - first, selections)
+        values = _model_values(model)
+        result = np.asarray(result)[lo - first:]
+        yield t[lo:hi], result[:, 1:]
+
+
+def iter_numpy(rhs, y0, t_end, n_points, chunk_points, method='dopri5', start=0):
+    """Stream ``(t, solution)`` chunks from the NumPy integrators.
+
+    ``y0`` may be a batch of shape ``(n, dim)``; chunks then have the shape
+    ``(n, chunk, dim)``. With ``start > 0`` ``y0`` is the state at
+    ``t[start - 1]``.
+    """
+    t = np.linspace(0, t_end, n_points)
+    y = np.asarray(y0, dtype=float)
+    for lo, hi in chunk_bounds(n_points, chunk_points, start):
+        first = max(lo - 1, 0)
+        states = integrate(rhs, y, t[first:hi], method=method)
+        y = states[..., -1, :]
+        yield t[lo:hi], states[..., lo - first:, :]
+
+
+def save_npy(path, chunks, n_points, start=0, checkpoint=None):
+    """Write streamed chunks into a memory-mapped ``.npy`` file.
+
+    The file holds ``(n_points, 1 + dim)`` rows laid out like a RoadRunner
+    result (time in column 0). Batched chunks give ``(n, n_points, 1 + dim)``.
+    With ``start > 0`` the chunks are written from row ``start`` into the
+    existing file. ``checkpoint`` (a :class:`checkpoint.Checkpointer`) is
+    saved after the chunks whenever it is due and after the last one, always
+    once the rows it covers are flushed. The open memory map is returned.
+    """
+    out = None if start == 0 else open_memmap(path, mode='r+')
+    pos = start
+    for t, chunk in chunks:
+        if out is None:
+            shape = chunk.shape[:-2] + (n_points, chunk.shape[-1] + 1)
+            out = open_memmap(path, mode='w+', dtype=float, shape=shape)
+        stop = pos + len(t)
+        out[..., pos:stop, 0] = t
+        out[..., pos:stop, 1:] = chunk
+        pos = stop
+        if checkpoint is not None and (pos == n_points or checkpoint.due()):
+            out.flush()
+            checkpoint.save(pos, t[-1], chunk[..., -1, :])
+    if out is None:
+        raise ValueError("no chunks to write")
+    out.flush()
+    return out
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+import recurrence
+
+
+def _line_histogram(sequences, n):
+    histogram = np.zeros(n + 1, dtype=np.int64)
+    for sequence in sequences:
+        edges = np.diff(np.concatenate([[0], sequence.astype(int), [0]]))
+        np.add.at(histogram, np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1), 1)
+    return histogram
+
+
+def _dense_rqa(x, radius, theiler, l_min=2, v_min=2):
+    """RQA measures from the full recurrence matrix."""
+    n = len(x)
+    i, j = np.indices((n, n))
+    matrix = (cdist(x, x) <= radius) & (np.abs(i - j) > theiler)
+    diagonal = _line_histogram([np.diagonal(matrix, k) for k in range(1, n)], n)
+    vertical = _line_histogram(matrix.T, n)
+    admissible = (n - theiler - 1) * (n - theiler) / 2
+    DET, L, L_max, ENTR = recurrence._line_measures(diagonal, l_min)
+    LAM, TT, V_max, _ = recurrence._line_measures(vertical, v_min)
+    return matrix.sum() / 2 / admissible, DET, L, L_max, ENTR, LAM, TT, V_max
+
+
+@pytest.fixture(scope='module')
+def trajectory():
+    t = np.linspace(0, 60, 1201)
+    rng = np.random.default_rng(0)
+    return np.column_stack([np.sin(t), np.cos(1.3 * t)]) + 0.02 * rng.standard_normal((len(t), 2))
+
+
+@pytest.mark.parametrize('block_size', [13, 37, 41, 100, 600, 2048])
+def test_rqa_matches_dense_matrix(trajectory, block_size):
+    radius, theiler = 0.15, 1
+    expected = _dense_rqa(trajectory, radius, theiler)
+    result = recurrence.recurrence_quantification(trajectory, radius, theiler=theiler,
+                                                  block_size=block_size)
+    got = (result.RR, result.DET, result.L, result.L_max, result.ENTR, result.LAM,
+           result.TT, result.V_max)
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('n, block_size', [(1201, 1200), (1202, 1200), (2049, 2048)])
+def test_rqa_trailing_block_without_recurrences(trajectory, n, block_size):
+    # The last block has one or two rows, with no recurrences above the Theiler band.
+    points = np.resize(trajectory, (n, 2))
+    expected = _dense_rqa(points, 0.15, 1)
+    for size in (block_size, 97, n):
+        result = recurrence.recurrence_quantification(points, 0.15, block_size=size)
+        got = (result.RR, result.DET, result.L, result.L_max, result.ENTR, result.LAM,
+               result.TT, result.V_max)
+        np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+
+def test_correlation_sum_matches_dense_count(trajectory):
+    theiler = 5
+    radii = recurrence.default_radii(trajectory, 8)
+    n = len(trajectory)
+    i, j = np.indices((n, n))
+    distance = cdist(trajectory, trajectory)[np.abs(i - j) > theiler]
+    expected = [(distance <= r).sum() for r in radii]
+    result = recurrence.correlation_sum(trajectory, radii, theiler=theiler, block_size=300)
+    np.testing.assert_array_equal(result.pairs, expected)
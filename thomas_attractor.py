@@ -1,8 +1,33 @@
-import tellurium as te
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.collections import LineCollection
-from matplotlib.colors import LinearSegmentedColormap
+
+import instrument
+import model_cache
+from checkpoint import Checkpointer, resume, run_info
+from density import plot_density, rasterize
+from integrators import check_backend, integrate
+from poincare import poincare_section
+from streaming import iter_numpy, iter_tellurium, save_npy
+
+
+# The state is shifted by (cx, cy, cz) so that all variables stay positive.
+CENTER = 2.0
+THOMAS_MODEL = '''
+model thomas
+    b = 0.208186
+
+    x' = sin((y-cy)) - b * (x-cx)
+    y' = sin((z-cz)) - b * (y-cy)
+    z' = sin((x-cx)) - b * (z-cz)
+
+    cx = 2
+    cy = 2
+    cz = 2
+
+    x = 2
+    y = 2
+    z = 2
+end
+'''
 
 
 class ThomasAttractor:
@@ -11,58 +36,147 @@ class ThomasAttractor:
     def __init__(self, b=0.208186):
         self.b = float(b)
 
-    def solve(self, initial_state=(0.1, 0.11, 0.09), t_end=500.0, n_points=50000):
-        """Simulate the Thomas attractor via Tellurium.
+    def params(self):
+        """Model parameters as a dict."""
+        return {'b': self.b}
+
+    def rhs(self, t, state):
+        """Right-hand side in shifted coordinates for the NumPy integrators."""
+        x, y, z = (state[..., i] - CENTER for i in range(3))
+        return np.stack([
+            np.sin(y) - self.b * x,
+            np.sin(z) - self.b * y,
+            np.sin(x) - self.b * z,
+        ], axis=-1)
+
+    def jvp(self, state, v):
+        """Jacobian-vector product of :meth:`rhs`, ``v`` has the shape ``(..., 3)``."""
+        x, y, z = (state[..., i] - CENTER for i in range(3))
+        vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+        return np.stack([
+            np.cos(y) * vy - self.b * vx,
+            np.cos(z) * vz - self.b * vy,
+            np.cos(x) * vx - self.b * vz,
+        ], axis=-1)
+
+    def _load_model(self, initial_state):
+        x0, y0, z0 = initial_state
+        model = model_cache.load(THOMAS_MODEL, {'b': self.b})
+        model['x'] = x0 + model['cx']
+        model['y'] = y0 + model['cy']
+        model['z'] = z0 + model['cz']
+        return model
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=(0.1, 0.11, 0.09), t_end=500.0, n_points=50000,
+              backend='tellurium', method='dopri5', out=None, chunk_points=10000,
+              checkpoint=None, checkpoint_every=60.0, resume_from=None, extend_to=None):
+        """Simulate the Thomas attractor via Tellurium or the NumPy integrators.
         
         For dense visualization matching Wikipedia, use long simulation times
         (500+ time units) with many points (50,000+) to fully explore the attractor.
-        """
-        x0, y0, z0 = initial_state
-        model = te.loada(f'''
-            model thomas
-                b = {self.b}
-
-                x' = sin((y-cy)) - b * (x-cx)
-                y' = sin((z-cz)) - b * (y-cy)
-                z' = sin((x-cx)) - b * (z-cz)
+        With ``backend='numpy'`` ``initial_state`` may be a batch of shape (n, 3).
+        If ``out`` is a path, the trajectory is streamed into a memory-mapped
+        ``.npy`` file in chunks of ``chunk_points`` and views of it are returned.
 
-                cx = 2
-                cy = 2
-                cz = 2
+        With a ``checkpoint`` path (which needs ``out``) the progress is saved
+        every ``checkpoint_every`` seconds and at the end. ``resume_from``
+        continues the run recorded in such a checkpoint, appending to its
+        output file; all other settings come from the checkpoint, and
+        ``extend_to`` carries the run on to a later end time.
+        """
+        check_backend(backend)
+        params = self.params()
+        if resume_from is not None:
+            info, start, state = resume(resume_from, 'ThomasAttractor', params, extend_to)
+            chunks = self.solve_iter(state - CENTER, info['t_end'], info['n_points'],
+                                     info['chunk_points'], info['backend'], info['method'],
+                                     start=start)
+            saver = Checkpointer(checkpoint or resume_from, info, checkpoint_every)
+            result = save_npy(info['out'], chunks, info['n_points'], start, saver)
+            return result[..., 0], result[..., 1:]
+        if checkpoint is not None and out is None:
+            raise ValueError("checkpoint needs an out file")
+        if out is not None:
+            chunks = self.solve_iter(initial_state, t_end, n_points, chunk_points, backend, method)
+            saver = None
+            if checkpoint is not None:
+                info = run_info('ThomasAttractor', params, initial_state, t_end, n_points,
+                                chunk_points, backend, method, out)
+                saver = Checkpointer(checkpoint, info, checkpoint_every)
+            result = save_npy(out, chunks, n_points, checkpoint=saver)
+            return result[..., 0], result[..., 1:]
 
-                x = {x0} + cx
-                y = {y0} + cy
-                z = {z0} + cz
+        if backend == 'numpy':
+            t = np.linspace(0, t_end, n_points)
+            y0 = np.asarray(initial_state, dtype=float) + CENTER
+            return t, integrate(self.rhs, y0, t, method=method)
 
-            end
-        ''')
-        result = model.simulate(0, t_end, n_points)
+        model = self._load_model(initial_state)
+        with instrument.stage('integrate'):
+            result = model.simulate(0, t_end, n_points)
+        instrument.record_array('integrate', result)
         t = result[:, 0]
         solution = result[:, 1:]
         return t, solution
 
-    def plot_3d(self, solution, figsize=(12, 10)):
-        """3D visualization with gradient coloring based on trajectory progression."""
-        fig = plt.figure(figsize=figsize)
-        ax = fig.add_subplot(111, projection='3d')
+    def solve_iter(self, initial_state=(0.1, 0.11, 0.09), t_end=500.0, n_points=50000,
+                   chunk_points=10000, backend='tellurium', method='dopri5', start=0):
+        """Yield the trajectory as ``(t, solution)`` chunks of at most ``chunk_points`` rows.
+
+        With ``start > 0`` the stream begins at sample ``start`` and
+        ``initial_state`` is the state at the sample before it.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            y0 = np.asarray(initial_state, dtype=float) + CENTER
+            return iter_numpy(self.rhs, y0, t_end, n_points, chunk_points, method, start)
+        return iter_tellurium(self._load_model(initial_state), t_end, n_points, chunk_points,
+                              start=start)
+
+    def poincare(self, section, initial_state=(0.1, 0.11, 0.09), t_end=5000.0, transient=0.0,
+                 **options):
+        """Crossings of ``section`` (a :class:`poincare.Section`), found during integration.
+
+        Like the NumPy backend of :meth:`solve`, the section and the returned
+        crossing states are in coordinates shifted by ``CENTER``. ``options``
+        are passed to :func:`poincare.iter_crossings`.
+        """
+        y0 = np.asarray(initial_state, dtype=float) + CENTER
+        return poincare_section(self.rhs, y0, t_end, section, transient, **options)
+
+    @instrument.timed('plot')
+    def plot_3d(self, solution, figsize=(12, 10), mode='scatter', bins=800, norm='log',
+                extent=None, show=True):
+        """3D visualization with gradient coloring based on trajectory progression.
+
+        ``mode='density'`` instead bins the projected points into a
+        ``bins x bins`` density image (``norm`` is ``'log'`` or ``'eq'``);
+        ``solution`` may then also be a chunk stream from :meth:`solve_iter`
+        (pass the projected ``extent`` for streams, otherwise the bounds of the
+        first chunk are used), and memory no longer grows with the number of
+        points drawn.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import LinearSegmentedColormap
         
         # Create custom colormap: yellow -> orange -> red -> purple -> blue
         colors = ['#FFFF00', '#FFA500', '#FF4500', '#8B008B', '#00008B']
         n_bins = 256
         cmap = LinearSegmentedColormap.from_list('thomas', colors, N=n_bins)
-        
-        # Create line segments for gradient coloring
-        points = solution
-        n_points = len(points)
-        
-        # Create segments
-        segments = []
-        for i in range(n_points - 1):
-            segment = [points[i], points[i + 1]]
-            segments.append(segment)
-        
-        # Create colors based on position in trajectory
-        colors_array = np.linspace(0, 1, n_points - 1)
+
+        if mode == 'density':
+            raster = rasterize(solution, bins=(bins, bins), extent=extent, elev=20, azim=45)
+            fig, ax = plt.subplots(figsize=figsize)
+            plot_density(raster, ax=ax, norm=norm, cmap=cmap.reversed(),
+                         title="Thomas' Cyclically Symmetric Attractor")
+            plt.tight_layout()
+            if show:
+                plt.show()
+            return fig
+
+        fig = plt.figure(figsize=figsize)
+        ax = fig.add_subplot(111, projection='3d')
         
         # Plot using scatter with gradient for dense, filled appearance
         # Higher point density creates the characteristic "filled" look of the attractor
@@ -92,10 +206,14 @@ class ThomasAttractor:
         ax.zaxis.pane.fill = False
         
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
-    def plot_time_series(self, t, solution, figsize=(12, 6)):
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, figsize=(12, 6), show=True):
         """Plot time series of x, y, z components."""
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(3, 1, figsize=figsize)
         labels = ['X', 'Y', 'Z']
         colors = ['#FF4500', '#8B008B', '#00008B']
@@ -108,7 +226,9 @@ class ThomasAttractor:
         axes[-1].set_xlabel('Time', fontsize=11)
         axes[0].set_title("Thomas Attractor - Time Series", fontsize=12)
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
 
 if __name__ == '__main__':
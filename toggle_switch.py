@@ -0,0 +1,148 @@
+import numpy as np
+
+import instrument
+import model_cache
+from integrators import check_backend, integrate
+
+
+TOGGLE_SWITCH_MODEL = '''
+model toggle_switch
+    u' = alpha1 / (1 + v^beta) - u
+    v' = alpha2 / (1 + u^gamma_) - v
+
+    // gamma je v Antimony rezervirana beseda
+    alpha1 = 5; alpha2 = 5; beta = 2; gamma_ = 2
+    u = 1; v = 0.1
+end
+'''
+
+
+class ToggleSwitch:
+    """Genetsko stikalo - dva represorja, ki se medsebojno zavirata (Gardner et al., 2000)
+
+    Za dovolj velik alpha1, alpha2 in beta, gamma > 1 ima sistem dve stabilni
+    stanji (visok u ali visok v), ločeni z nestabilnim sedlom.
+    """
+
+    def __init__(self, alpha1=5.0, alpha2=5.0, beta=2.0, gamma=2.0):
+        self.alpha1 = alpha1  # Stopnja sinteze represorja u
+        self.alpha2 = alpha2  # Stopnja sinteze represorja v
+        self.beta = beta      # Hillov koeficient zaviranja u z v
+        self.gamma = gamma    # Hillov koeficient zaviranja v z u
+
+    def params(self):
+        """Parametri modela kot slovar"""
+        return {'alpha1': self.alpha1, 'alpha2': self.alpha2, 'beta': self.beta,
+                'gamma': self.gamma}
+
+    def rhs(self, t, state):
+        """Desna stran sistema za NumPy integratorje, state ima obliko (..., 2)"""
+        u, v = state[..., 0], state[..., 1]
+        return np.stack([
+            self.alpha1 / (1 + v**self.beta) - u,
+            self.alpha2 / (1 + u**self.gamma) - v,
+        ], axis=-1)
+
+    def jacobian(self, state):
+        """Jacobijeva matrika desne strani v stanju state (oblika (2,))"""
+        u, v = state
+        du = -self.alpha2 * self.gamma * u**(self.gamma - 1) / (1 + u**self.gamma)**2
+        dv = -self.alpha1 * self.beta * v**(self.beta - 1) / (1 + v**self.beta)**2
+        return np.array([
+            [-1.0, dv],
+            [du, -1.0],
+        ])
+
+    def dfdp(self, state, name):
+        """Odvod desne strani po parametru name"""
+        u, v = state
+        if name == 'alpha1':
+            return np.array([1 / (1 + v**self.beta), 0.0])
+        if name == 'alpha2':
+            return np.array([0.0, 1 / (1 + u**self.gamma)])
+        if name == 'beta':
+            power = v**self.beta
+            log = np.log(v) if v > 0 else 0.0
+            return np.array([-self.alpha1 * power * log / (1 + power)**2, 0.0])
+        if name == 'gamma':
+            power = u**self.gamma
+            log = np.log(u) if u > 0 else 0.0
+            return np.array([0.0, -self.alpha2 * power * log / (1 + power)**2])
+        raise ValueError(f"neznan parameter {name!r}")
+
+    @instrument.timed('solve')
+    def solve(self, initial_state=[1.0, 0.1], t_end=50, n_points=2000,
+              backend='tellurium', method='dopri5'):
+        """Reši sistem z Tellurium (Antimony) ali z NumPy integratorjem
+
+        Z backend='numpy' je lahko initial_state paket oblike (n, 2), parametri
+        pa polja oblike (n,) za hkratno reševanje več parametrov.
+        """
+        check_backend(backend)
+        if backend == 'numpy':
+            t = np.linspace(0, t_end, n_points)
+            return t, integrate(self.rhs, initial_state, t, method=method)
+
+        u0, v0 = initial_state
+        model = model_cache.load(TOGGLE_SWITCH_MODEL, {
+            'alpha1': self.alpha1, 'alpha2': self.alpha2,
+            'beta': self.beta, 'gamma_': self.gamma, 'u': u0, 'v': v0,
+        })
+        with instrument.stage('integrate'):
+            result = model.simulate(0, t_end, n_points, ['time', 'u', 'v'])
+        instrument.record_array('integrate', result)
+        t = result[:, 0]
+        solution = result[:, 1:]
+        return t, solution
+
+    @instrument.timed('plot')
+    def plot_phase_plane(self, solutions=(), extent=None, show=True):
+        """Ničelnice in trajektorije v ravnini (u, v)"""
+        import matplotlib.pyplot as plt
+        if extent is None:
+            extent = (0, 1.1 * self.alpha1, 0, 1.1 * self.alpha2)
+        fig, ax = plt.subplots(figsize=(8, 7))
+        v = np.linspace(extent[2], extent[3], 500)
+        u = np.linspace(extent[0], extent[1], 500)
+        ax.plot(self.alpha1 / (1 + v**self.beta), v, color='tab:red', label="u' = 0")
+        ax.plot(u, self.alpha2 / (1 + u**self.gamma), color='tab:green', label="v' = 0")
+        for solution in solutions:
+            ax.plot(solution[:, 0], solution[:, 1], linewidth=0.8, alpha=0.6,
+                    color='tab:blue')
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        ax.set_xlabel('u')
+        ax.set_ylabel('v')
+        ax.set_title('Genetsko stikalo')
+        ax.legend()
+        plt.tight_layout()
+        if show:
+            plt.show()
+        return fig
+
+    @instrument.timed('plot')
+    def plot_time_series(self, t, solution, show=True):
+        """Časovni potek"""
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(2, 1, figsize=(10, 6))
+        for i, (ax, label) in enumerate(zip(axes, ['u', 'v'])):
+            ax.plot(t, solution[:, i])
+            ax.set_ylabel(label)
+            ax.grid(True, alpha=0.3)
+        axes[-1].set_xlabel('Čas')
+        plt.tight_layout()
+        if show:
+            plt.show()
+        return fig
+
+
+if __name__ == "__main__":
+    print("Genetsko stikalo - simulacija")
+
+    switch = ToggleSwitch(alpha1=5.0, alpha2=5.0)
+    initial_states = np.random.default_rng(0).uniform(0, 5, size=(20, 2))
+    t, solutions = switch.solve(initial_states, t_end=30, backend='numpy')
+
+    high_u = np.sum(solutions[:, -1, 0] > solutions[:, -1, 1])
+    print(f"{high_u} od {len(initial_states)} trajektorij konča z visokim u")
+    switch.plot_phase_plane(solutions)